@@ -1,97 +1,38 @@
-import sqlite3
 import streamlit as st
-import json
 import os
-from PIL import Image
-from oop_project2 import is_premium_user, record_transaction
-from footer import footer
-TRANSACTION_FEE_RATE = 0.01  # 1%
+import account_store
+import transfers
+import session_cache
+import auth
+import instrumentation
+from account_models import ACCOUNT_TYPES, BalanceException, SavingsAcct, VelocityError, make_account
+from membership import is_premium_user
 
 def main(username):
     """Main function that takes username as parameter"""
-    DATA_FILE = f"accounts_{username}.json"  # Separate file for each user
+    DATA_FILE = f"accounts_{username}.json"  # Legacy per-user file, imported once
 
-    class BalanceException(Exception):
-        pass
-
-    # Load account data from JSON
+    # Load account data from the accounts table
+    @instrumentation.timed("view.load_accounts")
     def load_accounts():
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r") as f:
-                return json.load(f)
-        return {}
-
-    # Save account data to JSON
-    def save_accounts(accounts):
-        with open(DATA_FILE, "w") as f:
-            json.dump(accounts, f, indent=4)
-
-    # Bank Account Base Class
-    class BankAccount:
-        def __init__(self, name, balance=0):
-            self.name = name
-            self.balance = balance
-
-        def get_balance(self):
-            return self.balance
-
-        def deposit(self, amount):
-            self.balance += amount
-            record_transaction(self.name, f"deposit to {self.name}", amount)
-            return self.get_balance()
-            
-
-        def viable_transaction(self, amount):
-            if self.balance >= amount:
-                return
-            raise BalanceException(f"Not enough funds in '{self.name}'. Balance: ${self.balance:.2f}")
-
-        def withdraw(self, amount):
-            try:
-                self.viable_transaction(amount)
-                self.balance -= amount
-                record_transaction(self.name, f"Withdraw from {self.name}", amount)
-                return self.get_balance()
-            except BalanceException as error:
-                raise BalanceException(f"Withdrawal interrupted: {error}")
-
-        def transfer(self, amount, other):
-            try:
-                fee = amount * TRANSACTION_FEE_RATE if not is_premium_user(self.name) else 0
-                self.viable_transaction(amount)
-                self.withdraw(amount)
-                other.deposit(amount)
-                record_transaction(self.name, 
-                         f"Transfer to {other.name}", 
-                         amount, 
-                         fee)
-            except BalanceException as error:
-                raise BalanceException(f"Transfer interrupted: {error}")
-
-    class InterestRewardAcct(BankAccount):
-        def deposit(self, amount):
-            interest_rate = 1.10 if is_premium_user(self.name) else 1.05
-            self.balance = self.balance + (amount * interest_rate)
-            record_transaction(self.name, "deposit", amount)
-            return self.get_balance()
-
-    class SavingsAcct(InterestRewardAcct):
-        def __init__(self, name, balance=0):
-            super().__init__(name, balance)
-            self.fee = 5
-
-        def withdraw(self, amount):
-            try:
-                total_amount = amount + self.fee
-                if not is_premium_user(self.name):
-                        total_amount += amount * TRANSACTION_FEE_RATE  # Additional fee for non-premium
-            
-                self.viable_transaction(total_amount)
-                self.balance = self.balance - total_amount
-                record_transaction(self.name, "withdraw", amount, total_amount-amount)
-                return self.get_balance()
-            except BalanceException as error:
-                raise BalanceException(f"\n Withdraw interrupted: {error}")
+        accounts = session_cache.load_accounts(username)
+        if not accounts and os.path.exists(DATA_FILE):
+            # First visit since the JSON storage was retired
+            account_store.import_json_file(DATA_FILE, username)
+            session_cache.invalidate(username)
+            accounts = session_cache.load_accounts(username)
+        return accounts
+
+    # Read, change and write the stored balance (and its ledger row) in one
+    # transaction; the cached `accounts` copy may be stale
+    @instrumentation.timed("view.apply_operation")
+    def apply_operation(operation, amount):
+        balance = account_store.apply_operation(username, selected, operation, amount)
+        session_cache.invalidate(username)
+        if balance is None:
+            raise BalanceException(f"Account '{selected}' no longer exists")
+        accounts[selected]["balance"] = balance
+        return balance
 
     # Streamlit Interface
     st.title(f"🏦 NeoBank - Welcome {username}")
@@ -102,15 +43,14 @@ def main(username):
     # Account creation
     st.subheader("➕ Open Account")
     new_name = st.text_input("Account Name")
-    new_type = st.selectbox("Account Type", ["BankAccount", "InterestRewardAcct", "SavingsAcct"])
+    new_type = st.selectbox("Account Type", list(ACCOUNT_TYPES))
     new_balance = st.number_input("Initial Balance", min_value=0.0, step=10.0)
 
     if st.button("Create Account"):
-        if new_name in accounts:
+        if new_name in accounts or not account_store.create_account(username, new_name, new_type, new_balance):
             st.error("Account with this name already exists.")
         else:
-            accounts[new_name] = {"balance": new_balance, "type": new_type}
-            save_accounts(accounts)
+            session_cache.invalidate(username)
             st.success(f"{new_type} '{new_name}' created with balance ${new_balance:.2f}")
             st.rerun()
 
@@ -127,12 +67,7 @@ def main(username):
 
     if selected:
         acc_data = accounts[selected]
-        if acc_data["type"] == "BankAccount":
-            acc = BankAccount(selected, acc_data["balance"])
-        elif acc_data["type"] == "InterestRewardAcct":
-            acc = InterestRewardAcct(selected, acc_data["balance"])
-        else:
-            acc = SavingsAcct(selected, acc_data["balance"])
+        acc = make_account(acc_data["type"], selected, acc_data["balance"], owner=username)
 
     if acc:
         st.write(f"### Current Balance: ${acc.get_balance():.2f}")
@@ -143,48 +78,63 @@ def main(username):
         else:
             st.metric("Available Balance", f"${current_balance:.2f}")
 
+        history_key = f"history_{username}"
         if st.button("View Transaction History"):
+            st.session_state[history_key] = {"rows": [], "cursor": None, "more": True}
+
+        if history_key in st.session_state:
+            state = st.session_state[history_key]
             try:
-                conn = sqlite3.connect('bank.db')
-                c = conn.cursor()
+                if state.get("version") != session_cache.version(username):
+                    # New transactions since the list was loaded: start over
+                    state.update(rows=[], cursor=None, more=True, version=session_cache.version(username))
+                if state["more"] and not state["rows"]:
+                    state["rows"], state["cursor"] = session_cache.history_page(username)
+                    state["more"] = state["cursor"] is not None
+                totals = session_cache.ledger_balance(username) or {"txn_count": 0}
+                summary = session_cache.history_summary(username)
+                statement = session_cache.statement(username)
+
+                st.write(f"Found {totals['txn_count']} transactions for user: {username}")
+                if summary["by_kind"]:
+                    # All-time totals per kind of transaction
+                    cols = st.columns(len(summary["by_kind"]) + 1)
+                    for col, (kind, agg) in zip(cols, sorted(summary["by_kind"].items())):
+                        col.metric(kind.title(), f"${agg['amount']:.2f}", delta=f"{agg['count']} txns", delta_color="off")
+                    cols[-1].metric("Fees", f"${summary['fees']:.2f}")
+                if statement:
+                    st.write(f"**Statement {statement['month']}**")
+                    # Ledger activity for the month; the account balance is shown above
+                    cols = st.columns(4)
+                    cols[0].metric("Deposits", f"${statement['deposits']:.2f}")
+                    cols[1].metric("Withdrawals", f"${statement['withdrawals']:.2f}")
+                    cols[2].metric("Fees", f"${statement['fees']:.2f}")
+                    cols[3].metric("Net ledger flow", f"${statement['net']:.2f}")
         
-                # First show debug info
-                c.execute("SELECT COUNT(*) FROM transactions WHERE username=?", (username,))
-                count = c.fetchone()[0]
-                st.write(f"Found {count} transactions for user: {username}")
-        
-        # Get transactions
-                c.execute("""
-                    SELECT type, amount, fee, timestamp 
-                    FROM transactions 
-                    WHERE username = ?
-                    ORDER BY timestamp DESC
-                    LIMIT 20
-                """, (username,))
-        
-                transactions = c.fetchall()
-        
-                if transactions:
+                if state["rows"]:
                     st.write("### Transaction History")
-                    for t in transactions:
+                    for t in state["rows"]:
                         cols = st.columns([3, 2, 1])
                         with cols[0]:
-                            st.write(f"**{t[0]}**")
+                            st.write(f"**{t['type']}**")
                         with cols[1]:
-                            st.write(f"${t[1]:.2f}")
+                            st.write(f"${t['amount']:.2f}")
                         with cols[2]:
-                            st.caption(t[3].split('T')[0])  # Just show date
+                            st.caption(t['timestamp'].split('T')[0])  # Just show date
                 
-                        if t[2] > 0:
-                            st.write(f"Fee: ${t[2]:.2f}")
+                        if t['fee'] > 0:
+                            st.write(f"Fee: ${t['fee']:.2f}")
                         st.divider()
+                    if state["more"] and st.button("Load more"):
+                        rows, state["cursor"] = session_cache.history_page(username, state["cursor"])
+                        state["rows"].extend(rows)
+                        state["more"] = state["cursor"] is not None
+                        st.rerun()
                 else:
                         st.info("No transactions found. Make a transaction to see history here.")
             
             except Exception as e:
                 st.error(f"Error loading transactions: {e}")
-            finally:
-                conn.close()
     else:
         st.warning("Please select an account to manage")
 
@@ -204,16 +154,15 @@ def main(username):
     amount = st.number_input("Amount", min_value=0.0, step=10.0, key="amount")
 
     if action == "Deposit" and st.button("Deposit"):
-        acc.deposit(amount)
-        accounts[selected]["balance"] = acc.get_balance()
-        save_accounts(accounts)
-        st.success(f"Deposited ${amount:.2f}")
+        try:
+            apply_operation("deposit", amount)
+            st.success(f"Deposited ${amount:.2f}")
+        except BalanceException as e:
+            st.error(str(e))
 
     elif action == "Withdraw" and st.button("Withdraw"):
         try:
-            acc.withdraw(amount)
-            accounts[selected]["balance"] = acc.get_balance()
-            save_accounts(accounts)
+            apply_operation("withdraw", amount)
             st.success(f"Withdrew ${amount:.2f}")
         except BalanceException as e:
             st.error(str(e))
@@ -222,27 +171,20 @@ def main(username):
         receiver = st.selectbox("Transfer To", [x for x in account_names if x != selected])
         if st.button("Transfer"):
             try:
-                receiver_data = accounts[receiver]
-                if receiver_data["type"] == "BankAccount":
-                    receiver_acc = BankAccount(receiver, receiver_data["balance"])
-                elif receiver_data["type"] == "InterestRewardAcct":
-                    receiver_acc = InterestRewardAcct(receiver, receiver_data["balance"])
-                else:
-                    receiver_acc = SavingsAcct(receiver, receiver_data["balance"])
-
-                acc.transfer(amount, receiver_acc)
-
-                accounts[selected]["balance"] = acc.get_balance()
-                accounts[receiver]["balance"] = receiver_acc.get_balance()
-                save_accounts(accounts)
+                # Debit, credit, fees and ledger rows commit together
+                balances = transfers.transfer(username, selected, receiver, amount,
+                                              premium=is_premium_user(username))
+                for name, balance in balances.items():
+                    accounts[name]["balance"] = balance
+                session_cache.invalidate(username)
                 st.success(f"Transferred ${amount:.2f} to {receiver}")
-            except BalanceException as e:
+            except transfers.TransferError as e:
+                st.error(f"Transfer interrupted: {e}")
+            except VelocityError as e:
                 st.error(str(e))
 
     # Logout button
     if st.button("Logout"):
+        auth.logout(st.session_state.get("auth_token"))
         st.session_state.logged_in = False
         st.rerun()
-
-
-footer()
\ No newline at end of file
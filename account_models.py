@@ -0,0 +1,161 @@
+"""Account domain model shared by the Streamlit app and batch jobs.
+
+The classes use __slots__ so bulk jobs can hold many of them cheaply, and
+account types are looked up in ACCOUNT_TYPES instead of an if/elif chain.
+Nothing here imports Streamlit.
+"""
+import instrumentation
+import ledger
+import velocity
+from membership import is_premium_user
+
+TRANSACTION_FEE_RATE = 0.01  # 1%
+SAVINGS_WITHDRAW_FEE = 5
+INTEREST_RATE = 1.05
+PREMIUM_INTEREST_RATE = 1.10
+
+ACCOUNT_TYPES = {}
+
+
+class BalanceException(Exception):
+    pass
+
+
+class VelocityError(BalanceException):
+    """Too many withdrawals/transfers in a window (see velocity.py)"""
+
+
+def register(cls):
+    """Class decorator adding an account type to ACCOUNT_TYPES"""
+    ACCOUNT_TYPES[cls.__name__] = cls
+    return cls
+
+
+def make_account(account_type, name, balance=0, owner=None):
+    try:
+        cls = ACCOUNT_TYPES[account_type]
+    except KeyError:
+        raise ValueError(f"Unknown account type: {account_type}") from None
+    return cls(name, balance, owner)
+
+
+def withdraw_fee(account_type, amount, premium):
+    """Fee an account type's withdraw() charges on top of the amount"""
+    return ACCOUNT_TYPES[account_type].withdraw_fee(amount, premium)
+
+
+def transfer_fee(amount, premium):
+    return 0.0 if premium else amount * TRANSACTION_FEE_RATE
+
+
+def credited_amount(account_type, amount, premium):
+    """What a deposit of amount adds to an account of this type"""
+    return ACCOUNT_TYPES[account_type].credited_amount(amount, premium)
+
+
+# Bank Account Base Class
+@register
+class BankAccount:
+    __slots__ = ("name", "balance", "owner")
+
+    def __init__(self, name, balance=0, owner=None):
+        self.name = name
+        self.balance = balance
+        # Username the account belongs to; ledger rows and premium checks use it
+        self.owner = owner if owner is not None else name
+
+    @staticmethod
+    def withdraw_fee(amount, premium):
+        return 0.0
+
+    @staticmethod
+    def credited_amount(amount, premium):
+        return amount
+
+    def is_premium(self):
+        return is_premium_user(self.owner)
+
+    def get_balance(self):
+        return self.balance
+
+    @instrumentation.timed("account.deposit")
+    def deposit(self, amount):
+        self.balance += amount
+        ledger.record(self.owner, f"deposit to {self.name}", amount)
+        return self.get_balance()
+
+    def viable_transaction(self, amount):
+        if self.balance >= amount:
+            return
+        raise BalanceException(f"Not enough funds in '{self.name}'. Balance: ${self.balance:.2f}")
+
+    def reserve_velocity(self, amount):
+        """Count this withdrawal against the limits; call inside velocity.held()"""
+        velocity.reserve(self.owner, self.name, type(self).__name__, amount, self.is_premium())
+
+    @instrumentation.timed("account.withdraw")
+    def withdraw(self, amount):
+        with velocity.held():
+            self.reserve_velocity(amount)
+            try:
+                self.viable_transaction(amount)
+                self.balance -= amount
+                ledger.record(self.owner, f"Withdraw from {self.name}", amount)
+                return self.get_balance()
+            except BalanceException as error:
+                raise BalanceException(f"Withdrawal interrupted: {error}")
+
+    @instrumentation.timed("account.transfer")
+    def transfer(self, amount, other):
+        """In-memory transfer; the app uses transfers.transfer for atomicity"""
+        try:
+            fee = transfer_fee(amount, self.is_premium())
+            self.viable_transaction(amount)
+            self.withdraw(amount)
+            other.deposit(amount)
+            ledger.record(self.owner, f"Transfer to {other.name}", amount, fee)
+        except BalanceException as error:
+            raise BalanceException(f"Transfer interrupted: {error}")
+
+
+@register
+class InterestRewardAcct(BankAccount):
+    __slots__ = ()
+
+    @staticmethod
+    def credited_amount(amount, premium):
+        return amount * (PREMIUM_INTEREST_RATE if premium else INTEREST_RATE)
+
+    @instrumentation.timed("account.deposit")
+    def deposit(self, amount):
+        credited = self.credited_amount(amount, self.is_premium())
+        self.balance = self.balance + credited
+        ledger.record(self.owner, f"deposit to {self.name}", amount)
+        if credited != amount:
+            ledger.record(self.owner, f"interest on {self.name}", credited - amount)
+        return self.get_balance()
+
+
+@register
+class SavingsAcct(InterestRewardAcct):
+    __slots__ = ()
+    fee = SAVINGS_WITHDRAW_FEE
+
+    @staticmethod
+    def withdraw_fee(amount, premium):
+        # Additional 1% for non-premium
+        return SAVINGS_WITHDRAW_FEE + (0 if premium else amount * TRANSACTION_FEE_RATE)
+
+    @instrumentation.timed("account.withdraw")
+    def withdraw(self, amount):
+        with velocity.held():
+            self.reserve_velocity(amount)
+            try:
+                total_amount = amount + self.withdraw_fee(amount, self.is_premium())
+                self.viable_transaction(total_amount)
+                self.balance = self.balance - total_amount
+                # Names the account, so velocity.rebuild() can refill its limits
+                ledger.record(self.owner, f"Withdraw from {self.name}", amount, total_amount - amount)
+                return self.get_balance()
+            except BalanceException as error:
+                raise BalanceException(f"\n Withdraw interrupted: {error}")
@@ -0,0 +1,142 @@
+"""Per-user bank accounts stored in the `accounts` table of bank.db.
+
+Replaces the old accounts_<username>.json files. Reads return the same
+{name: {"balance": ..., "type": ...}} shape the JSON files had, and every
+balance change is a single-row UPDATE instead of a full file rewrite.
+"""
+import datetime
+import glob
+import json
+import os
+import sqlite3
+
+import db
+import instrumentation
+import ledger
+import schema
+import velocity
+from account_models import make_account
+
+JSON_PATTERN = "accounts_*.json"
+
+
+def ensure_schema(conn):
+    """Add the account name column and lookup indexes to `accounts`"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(accounts)")]
+    if "name" not in columns:
+        conn.execute("ALTER TABLE accounts ADD COLUMN name TEXT")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_accounts_user_type
+                    ON accounts(username, account_type)""")
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_accounts_user_name
+                    ON accounts(username, name)""")
+
+
+@instrumentation.timed("db.load_accounts")
+def load_accounts(username):
+    with db.connection(username) as conn:
+        rows = conn.execute("""SELECT name, account_type, balance FROM accounts
+                               WHERE username=? AND name IS NOT NULL
+                               ORDER BY account_id""", (username,)).fetchall()
+    return {name: {"balance": balance, "type": acc_type} for name, acc_type, balance in rows}
+
+
+def opening_row(username, name, balance, timestamp):
+    """Ledger row for money an account starts with (negative for a shortfall)
+
+    It's a "deposit to ..." row so snapshots, history and reconcile count it
+    like any other deposit; the suffix tells it apart in the history view.
+    """
+    return (username, f"deposit to {name} (opening balance)", balance, 0.0, timestamp)
+
+
+def create_account(username, name, account_type, balance=0.0):
+    """Insert a new account; returns False if the name is already taken"""
+    try:
+        with db.transaction(username=username) as conn:
+            conn.execute("""INSERT INTO accounts (username, name, account_type, balance)
+                            VALUES (?, ?, ?, ?)""", (username, name, account_type, balance))
+            if balance:
+                conn.execute(ledger.INSERT_SQL, opening_row(
+                    username, name, balance, datetime.datetime.now().isoformat()))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+
+def adjust_balance(username, name, delta):
+    with db.transaction(username=username) as conn:
+        conn.execute("UPDATE accounts SET balance = balance + ? WHERE username=? AND name=?",
+                     (delta, username, name))
+
+
+@instrumentation.timed("db.apply_operation")
+def apply_operation(username, name, operation, amount):
+    """Run an account method (deposit/withdraw) and store the result atomically
+
+    The account row is read, changed through the account class (so fees,
+    interest and ledger rows match the UI) and written back in one
+    BEGIN IMMEDIATE transaction. Returns the new balance, or None if the
+    account doesn't exist; BalanceException rolls everything back.
+    """
+    # velocity.held() outside the transaction: a failed commit releases the slot too
+    with velocity.held(), db.transaction(immediate=True, username=username) as conn:
+        row = conn.execute("SELECT account_type, balance FROM accounts WHERE username=? AND name=?",
+                           (username, name)).fetchone()
+        if row is None:
+            return None
+        acc = make_account(row[0], name, row[1], owner=username)
+        getattr(acc, operation)(amount)
+        conn.execute("UPDATE accounts SET balance=? WHERE username=? AND name=?",
+                     (acc.get_balance(), username, name))
+    return acc.get_balance()
+
+
+def import_json_file(path, username):
+    """Import one accounts_<username>.json file; existing accounts are kept"""
+    with open(path, "r") as f:
+        accounts = json.load(f)
+    rows = [(username, name, data.get("type", "BankAccount"), data.get("balance", 0.0))
+            for name, data in accounts.items()]
+    now = datetime.datetime.now().isoformat()
+    with db.transaction(username=username) as conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM accounts WHERE username=?",
+                                                   (username,))}
+        rows = [row for row in rows if row[1] not in existing]
+        conn.executemany("""INSERT INTO accounts (username, name, account_type, balance)
+                            VALUES (?, ?, ?, ?)""", rows)
+        conn.executemany(ledger.INSERT_SQL, [opening_row(username, name, balance, now)
+                                             for _, name, _, balance in rows if balance])
+        return len(rows)
+
+
+def backfill_opening_balances(conn):
+    """Migration: one opening-balance ledger row per user whose accounts and ledger disagree
+
+    Accounts opened before opening balances were ledger rows (and any drift
+    from then) get a single baseline row on the user's first account, so a
+    replay of the ledger matches the summed account balances from here on.
+    """
+    rows = conn.execute("""SELECT t.username, a.name, t.total - COALESCE(b.balance, 0.0)
+                           FROM (SELECT username, MIN(account_id) AS first_id,
+                                        TOTAL(balance) AS total
+                                 FROM accounts WHERE name IS NOT NULL GROUP BY username) t
+                           JOIN accounts a ON a.account_id = t.first_id
+                           LEFT JOIN ledger_balances b ON b.username = t.username""").fetchall()
+    now = datetime.datetime.now().isoformat()
+    conn.executemany(ledger.INSERT_SQL, [opening_row(username, name, diff, now)
+                                         for username, name, diff in rows if abs(diff) > 0.005])
+
+
+def migrate_json_accounts(directory="."):
+    """One-shot import of every accounts_<username>.json file in directory"""
+    schema.ensure()
+    imported = {}
+    for path in sorted(glob.glob(os.path.join(directory, JSON_PATTERN))):
+        username = os.path.basename(path)[len("accounts_"):-len(".json")]
+        imported[username] = import_json_file(path, username)
+    return imported
+
+
+if __name__ == "__main__":
+    for user, count in migrate_json_accounts().items():
+        print(f"{user}: imported {count} account(s)")
@@ -0,0 +1,321 @@
+"""Monthly ledger partitions: closed months move out of `transactions`
+into compressed, read-only archive files.
+
+    python archive.py status
+    python archive.py run --keep 3          # archive everything older than the last 3 months
+    python archive.py show 2024-01 --user alice
+
+Each archived month is one file next to the database,
+archive/ledger-YYYY-MM.db.gz: a gzipped SQLite image of that month's rows
+from every shard, indexed on (username, timestamp, id). The directory
+database lists them in ledger_archives, and `transactions` keeps only
+the open months, so its size depends on recent activity, not on how old
+the ledger is.
+
+Statements for archived months stay in place, so balances, statements and
+transaction counts never touch an archive. History opens one only when a
+page reaches back into an archived month the user had activity in; it is
+loaded into memory read-only and the last ARCHIVE_CACHE stay open.
+
+A back-dated row for an archived month lands in `transactions` (the
+snapshot trigger still counts it) and the next run folds it into that
+month's file. A run interrupted between writing a file and clearing the
+hot rows shows those rows twice until it is run again.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import db
+import ledger
+import schema
+
+HOT_MONTHS = 3  # the current month and the two before it stay in `transactions`
+ARCHIVE_CACHE = 12  # archives kept loaded in memory
+COMPRESS_LEVEL = 6
+
+_loaded = OrderedDict()  # (path, mtime) -> in-memory connection
+_lock = threading.Lock()
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS ledger_archives
+                    (month TEXT PRIMARY KEY,
+                     path TEXT,
+                     rows INTEGER,
+                     bytes INTEGER,
+                     archived_at TEXT)""")
+
+
+def archive_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(db.get_pool().path)), "archive")
+
+
+def archive_path(month):
+    return os.path.join(archive_dir(), f"ledger-{month}.db.gz")
+
+
+def archived_months():
+    """Archived months, oldest first"""
+    with db.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT month FROM ledger_archives ORDER BY month")]
+
+
+def user_months(username, before=None, months=None):
+    """Archived months this user has rows in, newest first (from statements)"""
+    months = archived_months() if months is None else months
+    if not months:
+        return []
+    with db.connection(username) as conn:
+        rows = conn.execute("""SELECT month FROM statements
+                               WHERE username = ? AND month IN (SELECT value FROM json_each(?))
+                               ORDER BY month DESC""", (username, json.dumps(months))).fetchall()
+    return [row[0] for row in rows if before is None or row[0] <= before]
+
+
+def _open(path):
+    """Read-only in-memory copy of an archive file, cached by path and mtime"""
+    key = (path, os.path.getmtime(path))
+    conn = _loaded.get(key)
+    if conn is not None:
+        _loaded.move_to_end(key)
+        return conn
+    with open(path, "rb") as f:
+        image = gzip.decompress(f.read())
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.deserialize(image)
+    conn.execute("PRAGMA query_only = ON")
+    for stale in [k for k in _loaded if k[0] == path]:
+        _loaded.pop(stale).close()
+    _loaded[key] = conn
+    while len(_loaded) > ARCHIVE_CACHE:
+        _loaded.popitem(last=False)[1].close()
+    return conn
+
+
+def query(month, sql, params=()):
+    """Run a read against one archived month's `transactions`"""
+    with _lock:
+        return _open(archive_path(month)).execute(sql, params).fetchall()
+
+
+def fetch_rows(username, cursor=None, limit=20, months=None):
+    """Up to limit archived rows older than cursor, newest first
+
+    Rows are (id, type, amount, fee, timestamp), like history.fetch_page.
+    """
+    rows = []
+    sql = """SELECT id, type, amount, fee, timestamp FROM transactions WHERE username = ?"""
+    for month in user_months(username, cursor[0][:7] if cursor else None, months):
+        params = [username]
+        month_sql = sql
+        if cursor:
+            month_sql += " AND (timestamp, id) < (?, ?)"
+            params += list(cursor)
+        params.append(limit - len(rows))
+        rows += query(month, month_sql + " ORDER BY timestamp DESC, id DESC LIMIT ?", params)
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def iter_rows(username=None, since=None):
+    """Yield (username, type, amount, fee, timestamp) batches, oldest month first"""
+    sql = "SELECT username, type, amount, fee, timestamp FROM transactions"
+    clauses, params = [], []
+    if username:
+        clauses.append("username = ?")
+        params.append(username)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    months = user_months(username)[::-1] if username else archived_months()
+    for month in months:
+        if since is None or month >= since[:7]:
+            yield query(month, sql + " ORDER BY timestamp, id", params)
+
+
+def _month_bounds(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    following = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+    return month, following
+
+
+def _cutoff(keep, today=None):
+    """First month that stays hot"""
+    today = today or datetime.date.today()
+    index = today.year * 12 + today.month - 1 - (keep - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _write_archive(month, rows):
+    """Merge rows into the month's file; returns (rows in file, bytes)"""
+    path = archive_path(month)
+    conn = sqlite3.connect(":memory:")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            conn.deserialize(gzip.decompress(f.read()))
+    conn.execute("""CREATE TABLE IF NOT EXISTS transactions
+                    (source TEXT,
+                     id INTEGER,
+                     username TEXT,
+                     type TEXT,
+                     amount REAL,
+                     fee REAL,
+                     timestamp TEXT,
+                     PRIMARY KEY (source, id))""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_archive_user_time
+                    ON transactions(username, timestamp, id)""")
+    conn.executemany("INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    conn.execute("VACUUM")
+    data = gzip.compress(conn.serialize(), COMPRESS_LEVEL)
+    conn.close()
+
+    os.makedirs(archive_dir(), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(path):
+        os.chmod(path, 0o644)
+    os.replace(tmp, path)
+    os.chmod(path, 0o444)
+    return count, len(data)
+
+
+def archive_month(month):
+    """Move one month's rows from every shard into its archive; returns rows moved"""
+    start, end = _month_bounds(month)
+    pools = db.data_pools()
+    found = []
+    for pool in pools:
+        source = os.path.basename(pool.path)
+        with pool.connection() as conn:
+            rows = conn.execute("""SELECT id, username, type, amount, fee, timestamp
+                                   FROM transactions WHERE timestamp >= ? AND timestamp < ?""",
+                                (start, end)).fetchall()
+        found.append([(source,) + tuple(row) for row in rows])
+    moved = sum(len(rows) for rows in found)
+    if not moved:
+        return 0
+    count, size = _write_archive(month, [row for rows in found for row in rows])
+    with db.transaction() as conn:
+        conn.execute("""INSERT INTO ledger_archives (month, path, rows, bytes, archived_at)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(month) DO UPDATE SET
+                            path = excluded.path, rows = excluded.rows,
+                            bytes = excluded.bytes, archived_at = excluded.archived_at""",
+                     (month, archive_path(month), count, size, datetime.datetime.now().isoformat()))
+    # The file and catalogue are durable; only now drop the hot copies
+    for pool, rows in zip(pools, found):
+        if rows:
+            with pool.transaction(immediate=True) as conn:
+                conn.executemany("DELETE FROM transactions WHERE id = ?", [(row[1],) for row in rows])
+    return moved
+
+
+def run(keep=HOT_MONTHS, today=None):
+    """Archive every month before the last keep months; returns {month: rows moved}
+
+    Each month is one scan of `transactions`; after the first run that is
+    just the month that closed since the last one.
+    """
+    ledger.flush()
+    cutoff = _cutoff(keep, today)
+    months = set()
+    for pool in db.data_pools():
+        with pool.connection() as conn:
+            months.update(row[0] for row in conn.execute(
+                """SELECT DISTINCT substr(timestamp, 1, 7) FROM transactions
+                   WHERE timestamp < ?""", (cutoff,)))
+    return {month: archive_month(month) for month in sorted(months)}
+
+
+def closed_balance(statements):
+    """Ledger balance at the end of the archived months
+
+    Summed from each month's net (closing - opening): a back-dated row only
+    updates its own month, so later openings can lag until
+    snapshots.rebuild() re-chains them.
+    """
+    return sum(row[3] - row[2] for row in statements)
+
+
+def carry_over(source, target, username):
+    """Copy a user's archived-month statements to another shard (see shards.move_user)
+
+    Seeds ledger_balances with their totals, so the snapshot trigger
+    continues from there as the user's hot rows are copied.
+    """
+    months = json.dumps(archived_months())
+    rows = source.execute("""SELECT username, month, opening_balance, closing_balance, deposits,
+                                    withdrawals, fees, txn_count
+                             FROM statements
+                             WHERE username = ? AND month IN (SELECT value FROM json_each(?))
+                             ORDER BY month""", (username, months)).fetchall()
+    if not rows:
+        return
+    target.executemany("INSERT INTO statements VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    target.execute("""INSERT INTO ledger_balances (username, balance, fees, txn_count, updated_at)
+                      VALUES (?, ?, ?, ?, ?)""",
+                   (username, closed_balance(rows), sum(r[6] for r in rows), sum(r[7] for r in rows),
+                    rows[-1][1]))
+
+
+def status():
+    with db.connection() as conn:
+        archived = conn.execute("""SELECT month, rows, bytes, archived_at FROM ledger_archives
+                                   ORDER BY month""").fetchall()
+    hot = 0
+    for pool in db.data_pools():
+        with pool.connection() as conn:
+            hot += conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    return archived, hot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ledger archival")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="archived months and hot row count")
+    run_cmd = sub.add_parser("run", help="archive closed months")
+    run_cmd.add_argument("--keep", type=int, default=HOT_MONTHS, help="recent months to keep hot")
+    show = sub.add_parser("show", help="print an archived month's rows")
+    show.add_argument("month")
+    show.add_argument("--user")
+    args = parser.parse_args(argv)
+
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    if args.command == "run":
+        if args.keep < 1:
+            parser.error("--keep must be at least 1 (the current month stays hot)")
+        for month, moved in run(args.keep).items():
+            print(f"{month}: archived {moved} row(s)")
+    elif args.command == "show":
+        sql = "SELECT username, type, amount, fee, timestamp FROM transactions"
+        params = ()
+        if args.user:
+            sql, params = sql + " WHERE username = ?", (args.user,)
+        for row in query(args.month, sql + " ORDER BY timestamp, id", params):
+            print(*row, sep="\t")
+        return
+    archived, hot = status()
+    for month, rows, size, archived_at in archived:
+        print(f"{month}: {rows} rows, {size / 1024:.0f} KiB (archived {archived_at[:19]})")
+    print(f"hot: {hot} rows in transactions")
+
+
+if __name__ == "__main__":
+    main()
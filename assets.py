@@ -0,0 +1,103 @@
+"""Pre-rendered logo images served from memory.
+
+    python assets.py            # build static/logo_<width>.png ahead of time
+
+Each logo size is rendered once per process: from the pre-built file in
+ASSET_DIR if the build step ran, else resized from NBank.png, else drawn
+with PIL as a last resort. Nothing is written at request time, and every
+later call returns the same PNG bytes. PIL is only imported when a size
+actually has to be rendered.
+"""
+import argparse
+import io
+import os
+import threading
+
+LOGO_PATH = "NBank.png"
+ASSET_DIR = "static"
+LOGO_WIDTHS = (200,)
+LOGO_BACKGROUND = (42, 92, 170)
+LOGO_TEXT = (255, 215, 0)
+
+_logos = {}  # width -> PNG bytes
+_lock = threading.Lock()
+
+
+def _draw_logo():
+    from PIL import Image, ImageDraw, ImageFont
+    img = Image.new('RGB', (200, 100), color=LOGO_BACKGROUND)
+    d = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype("arial.ttf", 24)
+    except OSError:
+        font = ImageFont.load_default()
+    d.text((10, 10), "ProfitPeak", fill=LOGO_TEXT, font=font)
+    return img
+
+
+def _source_image():
+    from PIL import Image
+    try:
+        with Image.open(LOGO_PATH) as img:
+            img.load()
+            return img.copy()
+    except FileNotFoundError:
+        return _draw_logo()
+
+
+def _prebuilt_path(width):
+    return os.path.join(ASSET_DIR, f"logo_{width}.png")
+
+
+def render_logo(width, source=None):
+    """PNG bytes of the logo scaled to width (aspect ratio kept)"""
+    from PIL import Image
+    img = source or _source_image()
+    if img.width != width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+def logo_bytes(width=LOGO_WIDTHS[0]):
+    data = _logos.get(width)
+    if data is not None:
+        return data
+    with _lock:
+        data = _logos.get(width)
+        if data is None:
+            try:
+                with open(_prebuilt_path(width), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = render_logo(width)
+            _logos[width] = data
+    return data
+
+
+def preload(widths=LOGO_WIDTHS):
+    for width in widths:
+        logo_bytes(width)
+
+
+def build(widths=LOGO_WIDTHS, directory=ASSET_DIR):
+    """Write the pre-rendered logo sizes to directory"""
+    os.makedirs(directory, exist_ok=True)
+    source = _source_image()
+    written = []
+    for width in widths:
+        path = os.path.join(directory, f"logo_{width}.png")
+        with open(path, "wb") as f:
+            f.write(render_logo(width, source))
+        written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render logo assets")
+    parser.add_argument("--widths", type=int, nargs="+", default=list(LOGO_WIDTHS))
+    parser.add_argument("--out", default=ASSET_DIR)
+    args = parser.parse_args()
+    for path in build(args.widths, args.out):
+        print(path)
@@ -0,0 +1,80 @@
+"""User sign-up, login and short-lived session tokens.
+
+Passwords are hashed with passwords.py. Legacy SHA-256 hashes are
+upgraded the first time the user logs in with the right password. A
+successful login issues a token that stays valid for SESSION_TTL seconds
+after last use, so reruns check the token instead of re-running the KDF.
+"""
+import secrets
+import sqlite3
+
+import db
+import instrumentation
+import passwords
+from cache import TTLCache
+
+SESSION_TTL = 30 * 60  # seconds of inactivity before a token lapses
+SESSION_CACHE_SIZE = 10000
+
+_sessions = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL)
+_dummy_hash = None
+
+
+@instrumentation.timed("auth.create_user")
+def create_user(username, password, full_name, email):
+    hashed_pwd = passwords.hash_password(password)
+    try:
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO users VALUES (?, ?, ?, ?)",
+                         (username, hashed_pwd, full_name, email))
+            if db.shard_count():
+                # Pin the user's shard so adding shards later doesn't move them
+                db.set_shard(conn, username, db.home_shard(username))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+
+@instrumentation.timed("auth.verify_user")
+def verify_user(username, password):
+    global _dummy_hash
+    with db.connection() as conn:
+        row = conn.execute("SELECT password FROM users WHERE username=?", (username,)).fetchone()
+    if row is None:
+        # Burn a comparable amount of time so unknown users aren't obvious
+        if _dummy_hash is None:
+            _dummy_hash = passwords.hash_password(secrets.token_hex(8))
+        passwords.verify_password(password, _dummy_hash)
+        return False
+    stored = row[0]
+    if not passwords.verify_password(password, stored):
+        return False
+    if passwords.needs_rehash(stored):
+        with db.transaction() as conn:
+            conn.execute("UPDATE users SET password=? WHERE username=? AND password=?",
+                         (passwords.hash_password(password), username, stored))
+    return True
+
+
+def login(username, password):
+    """Return a session token for valid credentials, else None"""
+    if not verify_user(username, password):
+        return None
+    token = secrets.token_urlsafe(32)
+    _sessions.set(token, username)
+    return token
+
+
+def session_user(token):
+    """Username for a live token (and extend it), or None"""
+    if not token:
+        return None
+    username = _sessions.get(token)
+    if username is not None:
+        _sessions.set(token, username)
+    return username
+
+
+def logout(token):
+    if token:
+        _sessions.invalidate(token)
@@ -0,0 +1,286 @@
+"""Headless load test for the banking core.
+
+    python benchmark.py --ops deposit,transfer --workers 8 --iterations 2000
+    python benchmark.py --mode process --workers 4 --save baseline.json
+    python benchmark.py --compare baseline.json
+    python benchmark.py --mode process --workers 8 --shards 4
+    python benchmark.py --import-time --save imports.json
+
+Runs against a throwaway bank.db in a temp directory. For each operation it
+reports ops/sec, p50/p99 latency and how many calls failed with
+SQLITE_BUSY/"database is locked". --save writes the results as JSON and
+--compare prints the change against a saved baseline.
+
+--import-time instead cold-imports the entry points (oop_project2,
+service_api) in fresh interpreters under `python -X importtime` and reports
+the median import time plus the slowest modules, which is what a new
+Streamlit/API worker or a test run pays before doing anything.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import db
+
+OPERATIONS = ("deposit", "withdraw", "transfer", "record_transaction", "verify_user")
+USERS = 50
+PASSWORD = "bench-password"
+START_BALANCE = 1e9
+IMPORT_MODULES = ("oop_project2", "service_api")
+IMPORT_REPEAT = 7
+IMPORT_TOP = 8
+
+
+def _configure(path, shards=0):
+    db.configure(path, shards=shards)
+    import velocity
+    # Keep the limiter's cost in the timings but never trip it
+    velocity.configure({("*", velocity.BASIC): [(velocity.USER, velocity.MINUTE, 10 ** 6, None)]})
+
+
+def _setup(path, users, shards=0):
+    _configure(path, shards)
+    import schema
+    schema.ensure()
+    import account_store
+    import auth
+    for i in range(users):
+        name = f"bench_{i}"
+        auth.create_user(name, PASSWORD, name, f"{name}@example.com")
+        account_store.create_account(name, "checking", "BankAccount", START_BALANCE)
+        account_store.create_account(name, "savings", "SavingsAcct", START_BALANCE)
+
+
+def _warmup(_):
+    import oop_project2  # noqa: F401 -- pay the import cost outside the timings
+    return os.getpid()
+
+
+def _run_op(op, username):
+    import account_store
+    import auth
+    import oop_project2
+    import transfers
+    amount = random.randint(1, 100)
+    if op == "deposit":
+        account_store.adjust_balance(username, "checking", amount)
+        oop_project2.record_transaction(username, "deposit to checking", amount)
+    elif op == "withdraw":
+        account_store.adjust_balance(username, "checking", -amount)
+        oop_project2.record_transaction(username, "Withdraw from checking", amount)
+    elif op == "transfer":
+        transfers.transfer(username, "checking", "savings", amount)
+    elif op == "record_transaction":
+        oop_project2.record_transaction(username, "deposit", amount)
+    elif op == "verify_user":
+        auth.verify_user(username, PASSWORD)
+
+
+def _worker(op, iterations, users, seed):
+    """Run one worker's share of an operation; returns (latencies, busy)"""
+    import ledger
+    rng = random.Random(seed)
+    latencies, busy = [], 0
+    for _ in range(iterations):
+        username = f"bench_{rng.randrange(users)}"
+        start = time.perf_counter()
+        try:
+            _run_op(op, username)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            busy += 1
+        latencies.append(time.perf_counter() - start)
+    ledger.flush()
+    return latencies, busy
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_benchmark(ops=OPERATIONS, workers=4, iterations=1000, mode="thread", users=USERS,
+                  shards=0):
+    tmpdir = tempfile.mkdtemp(prefix="bank-bench-")
+    path = os.path.join(tmpdir, "bank.db")
+    _setup(path, users, shards)
+    per_worker = max(1, iterations // workers)
+
+    if mode == "process":
+        # spawn, so children don't inherit the parent's open SQLite handles
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_configure, initargs=(path, shards))
+    else:
+        executor = ThreadPoolExecutor(workers)
+
+    results = {}
+    with executor:
+        list(executor.map(_warmup, range(workers)))
+        for op in ops:
+            started = time.perf_counter()
+            futures = [executor.submit(_worker, op, per_worker, users, seed)
+                       for seed in range(workers)]
+            latencies, busy = [], 0
+            for future in futures:
+                lat, b = future.result()
+                latencies.extend(lat)
+                busy += b
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            results[op] = {
+                "ops": len(latencies),
+                "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+                "busy": busy,
+            }
+    db.close_all()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "shards": shards,
+        "iterations": per_worker * workers,
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def _parse_importtime(stderr):
+    """{module: (self_us, cumulative_us)} from -X importtime output"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure_imports(modules=IMPORT_MODULES, repeat=IMPORT_REPEAT):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (here, env.get("PYTHONPATH")) if p)
+    # Run from a temp dir so nothing touches the real bank.db
+    tmpdir = tempfile.mkdtemp(prefix="bank-imports-")
+    results = {}
+    try:
+        for module in modules:
+            samples, timings = [], {}
+            for _ in range(repeat):
+                proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                      cwd=tmpdir, env=env, capture_output=True, text=True)
+                if proc.returncode != 0:
+                    raise RuntimeError(f"import {module} failed: {proc.stderr.strip().splitlines()[-1]}")
+                timings = _parse_importtime(proc.stderr)
+                samples.append(timings[module][1] / 1000)
+            samples.sort()
+            slowest = sorted(timings.items(), key=lambda item: -item[1][0])[:IMPORT_TOP]
+            results[module] = {
+                "median_ms": samples[len(samples) // 2],
+                "min_ms": samples[0],
+                "modules": len(timings),
+                "slowest": [[name, self_us / 1000] for name, (self_us, _) in slowest],
+            }
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return {
+        "mode": "import-time",
+        "repeat": repeat,
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "imports": results,
+    }
+
+
+def print_import_report(report, baseline=None):
+    print(f"import time, median of {report['repeat']} cold starts, commit={report['commit']}")
+    for module, r in report["imports"].items():
+        line = f"{module:<20}{r['median_ms']:>10.1f} ms  (min {r['min_ms']:.1f}, {r['modules']} modules)"
+        base = (baseline or {}).get("imports", {}).get(module)
+        if base and base["median_ms"]:
+            change = (r["median_ms"] / base["median_ms"] - 1) * 100
+            line += f"   {change:+.1f}% vs {baseline.get('commit') or 'baseline'}"
+        print(line)
+        for name, self_ms in r["slowest"]:
+            print(f"    {name:<40}{self_ms:>8.1f} ms self")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    print(f"mode={report['mode']} workers={report['workers']} shards={report.get('shards', 0)} "
+          f"iterations={report['iterations']} commit={report['commit']}")
+    print(f"{'operation':<20}{'ops/sec':>12}{'p50 ms':>10}{'p99 ms':>10}{'busy':>8}")
+    for op, r in report["results"].items():
+        line = f"{op:<20}{r['ops_per_sec']:>12,.0f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['busy']:>8}"
+        base = (baseline or {}).get("results", {}).get(op)
+        if base and base["ops_per_sec"]:
+            change = (r["ops_per_sec"] / base["ops_per_sec"] - 1) * 100
+            line += f"   {change:+.1f}% vs {baseline.get('commit') or 'baseline'}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banking core load test")
+    parser.add_argument("--ops", default=",".join(OPERATIONS),
+                        help="comma-separated subset of: " + ", ".join(OPERATIONS))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=1000, help="calls per operation")
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--users", type=int, default=USERS)
+    parser.add_argument("--shards", type=int, default=0, help="spread users over this many files")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--import-time", action="store_true",
+                        help="measure cold import time of the entry points instead")
+    parser.add_argument("--repeat", type=int, default=IMPORT_REPEAT,
+                        help="fresh interpreters per module for --import-time")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.import_time:
+        report = measure_imports(repeat=args.repeat)
+        print_import_report(report, baseline)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(report, f, indent=4)
+        return 0
+
+    ops = [op.strip() for op in args.ops.split(",") if op.strip()]
+    unknown = set(ops) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operation(s): {', '.join(sorted(unknown))}")
+
+    report = run_benchmark(ops, args.workers, args.iterations, args.mode, args.users, args.shards)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Bulk import/export of the transactions ledger as CSV or JSONL.
+
+    python bulk_io.py import history.csv
+    python bulk_io.py import adjustments.jsonl --batch-size 20000
+    python bulk_io.py export ledger.jsonl --user alice --since 2024-01-01
+
+Files are streamed row by row, so memory use stays flat regardless of file
+size. Imported rows without a fee get the same fees the app charges
+(SavingsAcct withdraw fee, 1% transfer fee for non-premium users).
+"""
+import argparse
+import csv
+import datetime
+import json
+import sys
+import time
+
+import archive
+import db
+import account_models
+import membership
+import schema
+
+BATCH_SIZE = 10000
+FIELDS = ("username", "type", "amount", "fee", "timestamp")
+
+
+def _format_of(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def _read_rows(f, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def default_fee(trans_type, amount, account_type, premium):
+    kind = trans_type.lower()
+    if kind.startswith("withdraw") and account_type in account_models.ACCOUNT_TYPES:
+        return account_models.withdraw_fee(account_type, amount, premium)
+    if kind.startswith("transfer"):
+        return account_models.transfer_fee(amount, premium)
+    return 0.0
+
+
+def _to_ledger_row(record, premium_users, now):
+    amount = float(record["amount"])
+    fee = record.get("fee")
+    if fee in (None, ""):
+        fee = default_fee(record["type"], amount, record.get("account_type") or "BankAccount",
+                          record["username"] in premium_users)
+    return (record["username"], record["type"], amount, float(fee),
+            record.get("timestamp") or now)
+
+
+def _report(label, rows, started):
+    elapsed = time.perf_counter() - started
+    rate = rows / elapsed if elapsed else 0
+    print(f"{label} {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)", file=sys.stderr)
+
+
+def import_file(path, fmt=None, batch_size=BATCH_SIZE):
+    fmt = _format_of(path, fmt)
+    premium_users = membership.active_premium_users()
+    now = datetime.datetime.now().isoformat()
+    started = time.perf_counter()
+    total = 0
+    batch = []
+
+    def write(rows):
+        for pool, part in db.group_by_user(rows).items():
+            with pool.transaction(immediate=True) as conn:
+                conn.executemany("""INSERT INTO transactions (username, type, amount, fee, timestamp)
+                                    VALUES (?, ?, ?, ?, ?)""", part)
+
+    with open(path, "r", newline="") as f:
+        for line_no, record in enumerate(_read_rows(f, fmt), start=1):
+            try:
+                batch.append(_to_ledger_row(record, premium_users, now))
+            except (KeyError, ValueError, TypeError) as e:
+                raise ValueError(f"{path}: bad record #{line_no}: {e}") from e
+            if len(batch) >= batch_size:
+                write(batch)
+                total += len(batch)
+                batch = []
+                _report("imported", total, started)
+    if batch or not total:
+        if batch:
+            write(batch)
+            total += len(batch)
+        _report("imported", total, started)
+    return total
+
+
+def export_file(path, fmt=None, username=None, since=None, batch_size=BATCH_SIZE):
+    fmt = _format_of(path, fmt)
+    query = "SELECT username, type, amount, fee, timestamp FROM transactions"
+    clauses, params = [], []
+    if username:
+        clauses.append("username = ?")
+        params.append(username)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY id"
+
+    started = time.perf_counter()
+    total = 0
+    # One user lives on one shard; a full export walks the shards in turn
+    pools = [db.pool_for(username)] if username else db.data_pools()
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(FIELDS)
+
+        def emit(rows):
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(FIELDS, row))) + "\n" for row in rows)
+            return len(rows)
+
+        # Archived months first (oldest), then what is still in the hot tables
+        for rows in archive.iter_rows(username, since):
+            total += emit(rows)
+        for pool in pools:
+            with pool.connection() as conn:
+                cursor = conn.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    total += emit(rows)
+    _report("exported", total, started)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk transaction import/export")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS, help="number of shard files")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="stream a CSV/JSONL file into transactions")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=("csv", "jsonl"))
+    imp.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    exp = sub.add_parser("export", help="stream transactions out to CSV/JSONL")
+    exp.add_argument("path")
+    exp.add_argument("--format", choices=("csv", "jsonl"))
+    exp.add_argument("--user")
+    exp.add_argument("--since", help="ISO timestamp lower bound")
+    exp.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    args = parser.parse_args(argv)
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    if args.command == "import":
+        import_file(args.path, args.format, args.batch_size)
+    else:
+        export_file(args.path, args.format, args.user, args.since, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
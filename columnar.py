@@ -0,0 +1,383 @@
+"""Columnar ledger snapshot for analytics, read back with numpy.memmap.
+
+    python columnar.py export                          # bank.db (+ archives) -> ledger_columns/
+    python columnar.py report                          # fees, premium vs basic, deposits per day
+    python columnar.py query --sum amount --by kind --bucket month --since 2024-01-01
+
+export() reads the ledger once (hot tables and archived months) and
+writes one fixed-width file per column, sorted by time:
+
+    ts.i8       int64 seconds since the epoch (ledger wall-clock time)
+    amount.f8   float64
+    fee.f8      float64
+    type.u2/u4  code into types.json, which also maps each type to its kind
+    user.u4     code into users.json
+    premium.u1  per user code: 1 if premium at export time
+    leg.u1      1 for the "Withdraw from"/"deposit to" rows a transfer writes
+                next to its "Transfer to" row (same user and timestamp)
+
+Snapshot memory-maps the files, so opening one reads only meta.json and
+types.json (users.json only for per-user queries); a query slices the
+time range by binary search on ts (a view, no copy), buckets it by
+binary search too and groups with bincount. Reports never touch bank.db,
+so they don't compete with the app's writers. The snapshot is as of its
+export; re-export to refresh (the old files are swapped out whole).
+
+numpy is only needed here: pip install numpy.
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import time
+
+import db
+import schema
+
+try:
+    import numpy as np
+except ImportError:  # only this module needs it
+    np = None
+
+SNAPSHOT_DIR = "ledger_columns"
+FETCH_SIZE = 100000
+KINDS = ("deposit", "withdraw", "transfer", "interest", "other")
+BUCKETS = {"hour": "datetime64[h]", "day": "datetime64[D]", "month": "datetime64[M]"}
+GROUPS = ("kind", "user", "premium", "type")
+
+
+def _require_numpy():
+    if np is None:
+        raise SystemExit("columnar.py needs numpy: pip install numpy")
+
+
+def kind_of(trans_type):
+    """Leading verb of a ledger type, as in history.KIND_SQL"""
+    kind = trans_type.lower()
+    for name in KINDS[:-1]:
+        if kind.startswith(name):
+            return name
+    return "other"
+
+
+def _ledger_batches(include_archive):
+    if include_archive:
+        import archive
+        yield from archive.iter_rows()
+    for pool in db.data_pools():
+        with pool.connection() as conn:
+            cursor = conn.execute("SELECT username, type, amount, fee, timestamp FROM transactions")
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                yield rows
+
+
+def _time_order(ts, user):
+    """Row order by time, then user, so a transfer's three rows form one run
+
+    Only rows sharing a timestamp need the user key, so those few are
+    re-sorted on their own instead of sorting everything on two keys.
+    """
+    order = np.argsort(ts, kind="stable")
+    if len(ts) < 2:
+        return order
+    same = ts[order][1:] == ts[order][:-1]
+    tied = np.zeros(len(ts), bool)
+    tied[1:] |= same
+    tied[:-1] |= same
+    positions = np.flatnonzero(tied)
+    rows = order[positions]
+    order[positions] = rows[np.lexsort((user[rows], ts[rows]))]
+    return order
+
+
+def _transfer_legs(type_names, ts, user, codes):
+    """1 where a row is a debit/credit leg of a transfer (rows sorted by ts, user)"""
+    lowered = [t.lower() for t in type_names]
+    is_leg = np.array([t.startswith(("withdraw from ", "deposit to ")) for t in lowered], bool)
+    is_transfer = np.array([t.startswith("transfer") for t in lowered], bool)
+    if not len(ts):
+        return np.zeros(0, np.uint8)
+    starts = np.ones(len(ts), bool)
+    starts[1:] = (ts[1:] != ts[:-1]) | (user[1:] != user[:-1])
+    run = np.cumsum(starts) - 1
+    has_transfer = np.bincount(run, is_transfer[codes]) > 0
+    return (is_leg[codes] & has_transfer[run]).astype(np.uint8)
+
+
+def export(out=SNAPSHOT_DIR, include_archive=True):
+    """Write the columnar snapshot; returns the number of rows"""
+    _require_numpy()
+    users, types = {}, {}
+    parts = {"ts": [], "amount": [], "fee": [], "type": [], "user": []}
+    for rows in _ledger_batches(include_archive):
+        usernames, trans_types, amounts, fees, stamps = zip(*rows)
+        parts["user"].append(np.fromiter((users.setdefault(u, len(users)) for u in usernames),
+                                         np.uint32, len(rows)))
+        parts["type"].append(np.fromiter((types.setdefault(t, len(types)) for t in trans_types),
+                                         np.uint32, len(rows)))
+        parts["amount"].append(np.array(amounts, dtype=np.float64))
+        parts["fee"].append(np.array(fees, dtype=np.float64))
+        # numpy parses ISO-8601 in C; ledger times are naive wall-clock. Kept
+        # to the microsecond until the transfer legs are matched up
+        parts["ts"].append(np.array(stamps, dtype="datetime64[us]").astype(np.int64))
+    columns = {name: np.concatenate(chunks) if chunks else np.empty(0, np.int64)
+               for name, chunks in parts.items()}
+    type_names = sorted(types, key=types.get)
+    order = _time_order(columns["ts"], columns["user"])
+    columns["leg"] = _transfer_legs(type_names, columns["ts"][order], columns["user"][order],
+                                    columns["type"][order])
+    columns["ts"] //= 1000000
+    type_dtype = np.uint16 if len(types) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    dtypes = {"ts": np.int64, "amount": np.float64, "fee": np.float64, "type": type_dtype,
+              "user": np.uint32, "leg": np.uint8}
+
+    with db.connection() as conn:
+        premium = {row[0] for row in conn.execute(
+            "SELECT username FROM premium_members WHERE expiry_date > ?",
+            (datetime.datetime.now().isoformat(),))}
+    user_names = sorted(users, key=users.get)
+
+    tmp = out + ".new"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    files = {}
+    for name, dtype in dtypes.items():
+        filename = f"{name}.{np.dtype(dtype).str[1:]}"
+        column = columns[name] if name == "leg" else columns[name][order]
+        column.astype(dtype).tofile(os.path.join(tmp, filename))
+        files[name] = [filename, np.dtype(dtype).str]
+    premium_codes = np.fromiter((name in premium for name in user_names), np.uint8, len(user_names))
+    premium_codes.tofile(os.path.join(tmp, "premium.u1"))
+    files["premium"] = ["premium.u1", "|u1"]
+    with open(os.path.join(tmp, "users.json"), "w") as f:
+        json.dump(user_names, f)
+    with open(os.path.join(tmp, "types.json"), "w") as f:
+        json.dump([[t, kind_of(t)] for t in type_names], f)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"rows": int(len(order)), "files": files,
+                   "exported_at": datetime.datetime.now().isoformat(),
+                   "source": db.get_pool().path, "archives": include_archive}, f, indent=1)
+
+    # Swap the directory whole, so readers never see half a snapshot
+    old = out + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out):
+        os.rename(out, old)
+    os.rename(tmp, out)
+    shutil.rmtree(old, ignore_errors=True)
+    return int(len(order))
+
+
+class Snapshot:
+    """Memory-mapped columns of one export"""
+
+    def __init__(self, path=SNAPSHOT_DIR):
+        _require_numpy()
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.rows = self.meta["rows"]
+        self.columns = {}
+        for name, (filename, dtype) in self.meta["files"].items():
+            full = os.path.join(path, filename)
+            if os.path.getsize(full) == 0:
+                self.columns[name] = np.empty(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(full, dtype=dtype, mode="r")
+        self.path = path
+        with open(os.path.join(path, "types.json")) as f:
+            type_list = json.load(f)
+        self.types = [t for t, _ in type_list]
+        self.type_kind = np.array([KINDS.index(k) for _, k in type_list], dtype=np.uint8)
+        self._users = None
+
+    @property
+    def users(self):
+        """Usernames by code; loaded on first use (large with many users)"""
+        if self._users is None:
+            with open(os.path.join(self.path, "users.json")) as f:
+                self._users = json.load(f)
+        return self._users
+
+    def user_id(self, username):
+        try:
+            return self.users.index(username)
+        except ValueError:
+            return None
+
+    def _range(self, start=None, end=None):
+        """Row slice for [start, end), found by binary search on ts"""
+        ts = self.columns["ts"]
+        lo = 0 if start is None else int(np.searchsorted(ts, _epoch(start), "left"))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, _epoch(end), "left"))
+        return slice(lo, hi)
+
+    def _groups(self, by, rows):
+        """(codes, labels) for a grouping over a row slice"""
+        if by == "kind":
+            return self.type_kind[self.columns["type"][rows]], list(KINDS)
+        if by == "type":
+            return self.columns["type"][rows], self.types
+        if by == "user":
+            return self.columns["user"][rows], self.users
+        if by == "premium":
+            return self.columns["premium"][self.columns["user"][rows]], ["basic", "premium"]
+        raise ValueError(f"Unknown grouping: {by} (use one of {', '.join(GROUPS)})")
+
+    def _buckets(self, bucket, ts):
+        """(labels, offsets): bucket i is rows offsets[i]:offsets[i + 1] of sorted ts"""
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket: {bucket} (use one of {', '.join(BUCKETS)})")
+        unit = BUCKETS[bucket]
+        first = np.datetime64(int(ts[0]), "s").astype(unit)
+        last = np.datetime64(int(ts[-1]), "s").astype(unit)
+        labels = np.arange(first, last + np.timedelta64(2, unit[11:-1]))
+        edges = labels.astype("datetime64[s]").astype(np.int64)
+        return [str(label) for label in labels[:-1]], np.searchsorted(ts, edges, "left")
+
+    def aggregate(self, value="amount", by=None, bucket=None, start=None, end=None, kinds=None,
+                  username=None, legs=True):
+        """Sum value ("amount", "fee" or "rows") over [start, end)
+
+        by groups on "kind", "type", "user" or "premium"; bucket adds a time
+        bucket ("hour", "day" or "month"). legs=False leaves out a transfer's
+        withdraw/deposit legs, so each transfer counts once. Returns a
+        {key: total} dict keyed by group label, bucket label, or
+        (bucket, group) with both; a plain total with neither.
+        """
+        rows = self._range(start, end)
+        # Filters zero out weights instead of compacting, so columns stay views
+        keep = None
+        if kinds:
+            keep = np.isin(self.type_kind, [KINDS.index(k) for k in kinds])[self.columns["type"][rows]]
+        if username is not None:
+            uid = self.user_id(username)
+            if uid is None:
+                return {} if by or bucket else 0.0
+            match = self.columns["user"][rows] == uid
+            keep = match if keep is None else keep & match
+        if not legs:
+            if "leg" not in self.columns:
+                raise ValueError("This snapshot has no transfer-leg flags; export it again")
+            single = self.columns["leg"][rows] == 0
+            keep = single if keep is None else keep & single
+        if value == "rows":
+            weights = None if keep is None else keep.astype(np.float64)
+        else:
+            weights = self.columns[value][rows]
+            if keep is not None:
+                weights = np.where(keep, weights, 0.0)
+        count = keep  # None: every row in the slice counts
+
+        if not by and not bucket:
+            if weights is None:
+                return float(rows.stop - rows.start)
+            return float(weights.sum())
+        if rows.stop == rows.start:
+            return {}
+
+        codes, labels = self._groups(by, rows) if by else (None, None)
+        if bucket:
+            bucket_labels, offsets = self._buckets(bucket, self.columns["ts"][rows])
+        else:
+            bucket_labels, offsets = [None], np.array([0, rows.stop - rows.start])
+
+        result = {}
+        if not by:
+            # Sorted by time: a bucket's total is a difference of running sums
+            def per_bucket(values):
+                if values is None:
+                    return np.diff(offsets)
+                running = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+                return running[offsets[1:]] - running[offsets[:-1]]
+            totals, present = per_bucket(weights), per_bucket(count)
+            for label, total, seen in zip(bucket_labels, totals, present):
+                if seen:
+                    result[label] = float(total)
+            return result
+
+        for label, lo, hi in zip(bucket_labels, offsets[:-1], offsets[1:]):
+            if lo == hi:
+                continue
+            part = codes[lo:hi]
+            seen = np.bincount(part, None if count is None else count[lo:hi], len(labels))
+            totals = seen if weights is None else np.bincount(part, weights[lo:hi], len(labels))
+            for group in np.flatnonzero(seen):
+                key = labels[group] if label is None else (label, labels[group])
+                result[key] = float(totals[group])
+        return result
+
+
+def _epoch(value):
+    """ISO date/datetime string (or datetime) -> int64 seconds, as stored in ts"""
+    return np.datetime64(value, "s").astype(np.int64)
+
+
+def report(snapshot, start=None, end=None):
+    """The standing reports: fees earned, premium vs basic volume, deposits per day"""
+    return {
+        "fees_by_month": snapshot.aggregate("fee", bucket="month", start=start, end=end),
+        # A transfer writes three rows; only its "Transfer to" row counts here
+        "volume_by_tier": snapshot.aggregate("amount", by="premium", start=start, end=end,
+                                             kinds=("withdraw", "transfer", "deposit"), legs=False),
+        "deposits_per_day": snapshot.aggregate("amount", bucket="day", start=start, end=end,
+                                               kinds=("deposit",)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar ledger snapshot")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS)
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="snapshot directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="write the ledger into columnar files")
+    exp.add_argument("--no-archive", action="store_true", help="skip archived months")
+    rep = sub.add_parser("report", help="fees, premium vs basic volume, deposits per day")
+    qry = sub.add_parser("query", help="one aggregate")
+    qry.add_argument("--sum", default="amount", choices=("amount", "fee", "rows"))
+    qry.add_argument("--by", choices=GROUPS)
+    qry.add_argument("--bucket", choices=tuple(BUCKETS))
+    qry.add_argument("--kind", action="append", choices=KINDS)
+    qry.add_argument("--user")
+    qry.add_argument("--no-legs", action="store_true",
+                     help="leave out transfers' withdraw/deposit legs (each transfer counts once)")
+    for p in (rep, qry):
+        p.add_argument("--since", help="ISO date/time lower bound")
+        p.add_argument("--until", help="ISO date/time upper bound (exclusive)")
+    args = parser.parse_args(argv)
+    _require_numpy()
+
+    if args.command == "export":
+        db.configure(args.db, shards=args.shards)
+        schema.ensure()
+        started = time.perf_counter()
+        rows = export(args.dir, include_archive=not args.no_archive)
+        print(f"Exported {rows} row(s) to {args.dir} in {time.perf_counter() - started:.2f}s")
+        return
+
+    snapshot = Snapshot(args.dir)
+    started = time.perf_counter()
+    if args.command == "report":
+        results = report(snapshot, args.since, args.until)
+    else:
+        results = {"result": snapshot.aggregate(args.sum, args.by, args.bucket, args.since,
+                                                args.until, args.kind, args.user,
+                                                not args.no_legs)}
+    elapsed = time.perf_counter() - started
+    for name, result in results.items():
+        print(name)
+        if isinstance(result, dict):
+            for key, total in sorted(result.items(), key=lambda item: str(item[0])):
+                print(f"  {key}: {total:,.2f}")
+        else:
+            print(f"  {result:,.2f}")
+    print(f"({snapshot.rows:,} rows as of {snapshot.meta['exported_at'][:19]}, "
+          f"{elapsed * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
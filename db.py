@@ -0,0 +1,256 @@
+"""Shared SQLite connection layer for bank.db.
+
+Connections are opened once, tuned with WAL and a few pragmas, and handed
+out from a bounded pool. A thread keeps the same connection for as long as
+it holds one, so nested helpers (e.g. add_funds -> record_transaction) share
+a single connection and transaction instead of opening their own.
+
+With configure(shards=N), per-user data (accounts, transactions,
+statements, partner usage) is spread over N files, bank.shard<i>.db, each
+with its own pool and writer lock, while bank.db stays the directory:
+users, premium memberships and the user_shards placement table. Helpers
+pass username= to route to the user's shard; without it they get the
+directory. A user's rows all live on one shard, so their transfers and
+deposits remain single-transaction. With no shards (the default) every
+call goes to bank.db as before.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+import instrumentation
+from cache import TTLCache
+
+DB_PATH = "bank.db"
+POOL_SIZE = 8
+POOL_TIMEOUT = 10.0  # seconds to wait for a free connection
+BUSY_TIMEOUT_MS = 5000
+SHARDS = int(os.environ.get("BANK_SHARDS", "0"))  # shard files next to DB_PATH; 0 = unsharded
+PLACEMENT_CACHE_SIZE = 100000
+PLACEMENT_CACHE_TTL = 300  # seconds; rebalance runs should outlast it or restart workers
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",  # ~8 MB page cache per connection
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+@instrumentation.timed("db.connect")
+def _open_connection(path):
+    # isolation_level=None puts the connection in autocommit mode, so
+    # transaction() below decides exactly when BEGIN/COMMIT happen.
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    conn.set_trace_callback(instrumentation.on_query)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._all = []
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    conn = _open_connection(self.path)
+                except Exception:
+                    self._created -= 1
+                    raise
+                self._all.append(conn)
+                return conn
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise PoolTimeout(f"No free connection to {self.path} after {POOL_TIMEOUT}s")
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Yield this thread's connection, checking one out if needed."""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        with instrumentation.timer("db.checkout"):
+            conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._checkin(conn)
+
+    def in_transaction(self):
+        """True if this thread holds a connection with an open transaction"""
+        held = getattr(self._local, "conn", None)
+        return held is not None and held.in_transaction
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Run the block in one transaction; joins an outer one if open."""
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all = []
+            self._created = 0
+            self._idle = queue.LifoQueue()
+
+
+def shard_path(path, index):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.shard{index}{ext or '.db'}"
+
+
+_pool = ConnectionPool()
+_shards = [ConnectionPool(shard_path(DB_PATH, i)) for i in range(SHARDS)]  # empty: unsharded
+_pool_lock = threading.Lock()
+_placements = TTLCache(maxsize=PLACEMENT_CACHE_SIZE, ttl=PLACEMENT_CACHE_TTL)
+
+
+def configure(path=DB_PATH, pool_size=POOL_SIZE, shards=0):
+    """Point the shared pools at another database (tests, benchmarks).
+
+    path is the directory database; shards > 0 adds that many shard files
+    next to it.
+    """
+    global _pool, _shards
+    with _pool_lock:
+        for pool in [_pool] + _shards:
+            pool.close_all()
+        _pool = ConnectionPool(path, pool_size)
+        _shards = [ConnectionPool(shard_path(path, i), pool_size) for i in range(shards)]
+        _placements.clear()
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def shard_count():
+    return len(_shards)
+
+
+def shard_pool(index):
+    return _shards[index]
+
+
+def all_pools():
+    """Directory first, then every shard (for schema migrations)"""
+    return [_pool] + _shards
+
+
+def data_pools():
+    """Pools holding per-user data: the shards, or bank.db when unsharded"""
+    return list(_shards) or [_pool]
+
+
+def home_shard(username):
+    """Shard a new user is placed on: a stable hash of the username"""
+    return zlib.crc32(username.encode("utf-8")) % len(_shards)
+
+
+def shard_of(username):
+    index = _placements.get(username)
+    if index is not None:
+        return index
+    try:
+        with _pool.connection() as conn:
+            row = conn.execute("SELECT shard FROM user_shards WHERE username=?",
+                               (username,)).fetchone()
+    except sqlite3.OperationalError:
+        row = None  # directory not migrated yet
+    index = row[0] if row is not None and row[0] < len(_shards) else home_shard(username)
+    _placements.set(username, index)
+    return index
+
+
+def set_shard(conn, username, index):
+    """Record username's shard in the directory (conn must be a directory connection)"""
+    conn.execute("""INSERT INTO user_shards (username, shard) VALUES (?, ?)
+                    ON CONFLICT(username) DO UPDATE SET shard = excluded.shard""",
+                 (username, index))
+    _placements.set(username, index)
+
+
+def pool_for(username=None):
+    if username is None or not _shards:
+        return _pool
+    return _shards[shard_of(username)]
+
+
+def group_by_user(rows, column=0):
+    """Split rows into {pool: [rows]} by the username in row[column]"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(pool_for(row[column]), []).append(row)
+    return groups
+
+
+def connection(username=None):
+    return pool_for(username).connection()
+
+
+def transaction(immediate=False, username=None):
+    return pool_for(username).transaction(immediate)
+
+
+def in_transaction(username=None):
+    return pool_for(username).in_transaction()
+
+
+def close_all():
+    for pool in [_pool] + _shards:
+        pool.close_all()
@@ -0,0 +1,85 @@
+"""Transaction history queries backed by a (username, timestamp, id) index.
+
+Pages are fetched with keyset pagination: the cursor is the (timestamp, id)
+of the last row shown, so page N costs the same as page 1 instead of
+scanning and discarding N * limit rows. Totals are computed in SQL.
+
+Closed months live in archive files (archive.py); a page only opens them
+once it runs past the rows still in `transactions`.
+"""
+import archive
+import db
+
+PAGE_SIZE = 20
+
+# Ledger types are free text ("deposit to Savings", "Transfer to X", ...);
+# bucket them by their leading verb for the totals.
+KIND_SQL = """CASE
+    WHEN lower(type) LIKE 'deposit%' THEN 'deposit'
+    WHEN lower(type) LIKE 'withdraw%' THEN 'withdraw'
+    WHEN lower(type) LIKE 'transfer%' THEN 'transfer'
+    WHEN lower(type) LIKE 'interest%' THEN 'interest'
+    WHEN lower(type) LIKE 'premium fee%' THEN 'premium fee'
+    ELSE lower(type) END"""
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_transactions_user_time
+                    ON transactions(username, timestamp, id)""")
+
+
+def encode_cursor(row):
+    return f"{row['timestamp']}|{row['id']}"
+
+
+def decode_cursor(cursor):
+    timestamp, _, row_id = cursor.rpartition("|")
+    return timestamp, int(row_id)
+
+
+def fetch_page(username, cursor=None, limit=PAGE_SIZE):
+    """Return (rows, next_cursor) newest first; next_cursor is None at the end"""
+    query = """SELECT id, type, amount, fee, timestamp FROM transactions
+               WHERE username = ?"""
+    params = [username]
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query += " AND (timestamp, id) < (?, ?)"
+        params += [timestamp, row_id]
+    query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    with db.connection(username) as conn:
+        fetched = conn.execute(query, params).fetchall()
+    archived = archive.archived_months()
+    # Archived rows can only come first once the page reaches an archived month
+    if archived and (len(fetched) <= limit or fetched[-1][4][:7] <= archived[-1]):
+        older = archive.fetch_rows(username, decode_cursor(cursor) if cursor else None, limit + 1,
+                                   months=archived)
+        fetched = sorted(fetched + older, key=lambda r: (r[4], r[0]), reverse=True)[:limit + 1]
+    rows = [{"id": r[0], "type": r[1], "amount": r[2], "fee": r[3], "timestamp": r[4]}
+            for r in fetched[:limit]]
+    next_cursor = encode_cursor(rows[-1]) if len(fetched) > limit else None
+    return rows, next_cursor
+
+
+def summary(username):
+    """Transaction count, per-kind totals and fee sum for one user"""
+    sql = f"""SELECT {KIND_SQL} AS kind, COUNT(*), TOTAL(amount), TOTAL(fee)
+              FROM transactions WHERE username = ?
+              GROUP BY kind"""
+    with db.connection(username) as conn:
+        rows = conn.execute(sql, (username,)).fetchall()
+    for month in archive.user_months(username):
+        rows += archive.query(month, sql, (username,))
+    by_kind = {}
+    for kind, count, amount, fees in rows:
+        totals = by_kind.setdefault(kind, {"count": 0, "amount": 0.0, "fees": 0.0})
+        totals["count"] += count
+        totals["amount"] += amount
+        totals["fees"] += fees
+    return {
+        "count": sum(k["count"] for k in by_kind.values()),
+        "fees": sum(k["fees"] for k in by_kind.values()),
+        "by_kind": by_kind,
+    }
@@ -0,0 +1,212 @@
+"""Timing, query counting and optional profiling for the hot paths.
+
+    @timed("db.record_transaction")     # decorator
+    with timer("logo.load"): ...         # context manager
+    with render(): main()                # one page render
+
+Every timed call feeds a process-wide histogram. Inside render(), the
+calls and SQL statements are also tallied for that render alone, so the
+admin panel can show what the last page cost. SQL statements are counted
+by a trace callback that db.py installs on each pooled connection, and
+prometheus_text() exports everything for scraping.
+
+Profiling is off by default. Set BANK_PROFILE=cprofile or
+BANK_PROFILE=tracemalloc (or call set_profile_mode) to capture the
+top entries of each render.
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ENABLED = True
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+RECENT_RENDERS = 20
+PROFILE_TOP = 25
+
+_lock = threading.Lock()
+_timings = {}  # name -> {"count", "total_ms", "max_ms", "buckets"}
+_counters = {}  # name -> int
+_collectors = {}  # prefix -> fn returning {name: number}, exported as gauges
+_local = threading.local()
+_renders = deque(maxlen=RECENT_RENDERS)
+_profile_mode = os.environ.get("BANK_PROFILE") or None
+
+
+def set_profile_mode(mode):
+    """None, "cprofile" or "tracemalloc" """
+    global _profile_mode
+    if mode not in (None, "cprofile", "tracemalloc"):
+        raise ValueError(f"Unknown profile mode: {mode}")
+    _profile_mode = mode
+
+
+def get_profile_mode():
+    return _profile_mode
+
+
+def _observe(name, elapsed_ms):
+    with _lock:
+        stat = _timings.get(name)
+        if stat is None:
+            stat = _timings[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                     "buckets": [0] * len(BUCKETS_MS)}
+        stat["count"] += 1
+        stat["total_ms"] += elapsed_ms
+        if elapsed_ms > stat["max_ms"]:
+            stat["max_ms"] = elapsed_ms
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                stat["buckets"][i] += 1
+                break
+    current = getattr(_local, "render", None)
+    if current is not None:
+        calls = current["calls"].setdefault(name, [0, 0.0])
+        calls[0] += 1
+        calls[1] += elapsed_ms
+
+
+def register_collector(prefix, fn):
+    """Export fn()'s numeric values as gauges named <prefix>_<key>"""
+    _collectors[prefix] = fn
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def on_query(statement):
+    """sqlite3 trace callback: count statements run during a render
+
+    Runs once per statement (and per row of executemany), so it stays
+    lock-free; the render's total is added to db.queries when it ends.
+    """
+    current = getattr(_local, "render", None)
+    if current is not None:
+        current["queries"] += 1
+
+
+@contextmanager
+def timer(name):
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe(name, (time.perf_counter() - start) * 1000)
+
+
+def timed(name=None):
+    """Decorator recording each call's latency under name"""
+    def decorate(fn):
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _observe(label, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def render(name="page"):
+    """Collect per-render call and query counts (and a profile if enabled)"""
+    if not ENABLED or getattr(_local, "render", None) is not None:
+        yield None
+        return
+    current = {"name": name, "started": time.time(), "queries": 0, "calls": {},
+               "elapsed_ms": 0.0, "profile": None}
+    _local.render = current
+    mode = _profile_mode
+    profiler = before = None
+    if mode == "cprofile":
+        import cProfile  # profilers are only imported when a mode is on
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif mode == "tracemalloc":
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        if profiler is not None:
+            import io
+            import pstats
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            current["profile"] = out.getvalue()
+        elif before is not None:
+            diff = tracemalloc.take_snapshot().compare_to(before, "lineno")[:PROFILE_TOP]
+            current["profile"] = "\n".join(str(stat) for stat in diff)
+        _local.render = None
+        _observe(f"render.{name}", current["elapsed_ms"])
+        with _lock:
+            _counters["db.queries"] = _counters.get("db.queries", 0) + current["queries"]
+            _renders.append(current)
+
+
+def recent_renders():
+    with _lock:
+        return list(_renders)
+
+
+def snapshot():
+    with _lock:
+        timings = {name: dict(stat, buckets=list(stat["buckets"])) for name, stat in _timings.items()}
+        return {"timings": timings, "counters": dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _renders.clear()
+
+
+def _metric_name(name):
+    return "bank_" + "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def prometheus_text():
+    """All metrics in the Prometheus text exposition format"""
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, stat in sorted(data["timings"].items()):
+        metric = _metric_name(name) + "_ms"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS_MS, stat["buckets"]):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {stat["count"]}')
+        lines.append(f"{metric}_sum {stat['total_ms']:.3f}")
+        lines.append(f"{metric}_count {stat['count']}")
+    for prefix, fn in sorted(_collectors.items()):
+        try:
+            values = fn() or {}
+        except Exception:
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = _metric_name(f"{prefix}_{key}")
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,179 @@
+"""Nightly interest accrual and premium fee batch job.
+
+    python interest_batch.py                   # accrue one day of interest
+    python interest_batch.py --charge-premium  # also take the monthly PREMIUM_COST
+
+Accounts are read in account_id order, CHUNK_SIZE rows at a time, into
+NumPy arrays (balances, type codes, premium flags). Interest and fees are
+computed on whole arrays, and each chunk is read and written back (one
+executemany of balance deltas, one for ledger rows) inside a single
+BEGIN IMMEDIATE transaction, so concurrent deposits aren't overwritten.
+
+Annual rates come from each account type's deposit bonus (5% basic, 10%
+premium for InterestRewardAcct/SavingsAcct, 0% for BankAccount). The
+premium charge is taken from each premium member's first account, at
+most once per calendar month: premium_charges records who was charged
+for which month, so a nightly run with --charge-premium is safe. With
+sharding, each shard is processed in turn with its own chunks and commits.
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+
+import numpy as np
+
+import db
+import ledger
+import schema
+from account_models import ACCOUNT_TYPES
+from membership import PREMIUM_COST, active_premium_users
+
+CHUNK_SIZE = 50000
+DAYS_PER_YEAR = 365
+
+TYPE_CODES = {name: code for code, name in enumerate(ACCOUNT_TYPES)}
+
+
+def _annual_rates(premium):
+    return np.array([ACCOUNT_TYPES[name].credited_amount(1.0, premium) - 1.0
+                     for name in TYPE_CODES], dtype=np.float64)
+
+
+def _charge_account_ids(conn, premium_users):
+    """Each premium member's first (lowest account_id) account"""
+    rows = conn.execute("""SELECT username, MIN(account_id) FROM accounts
+                           WHERE name IS NOT NULL GROUP BY username""")
+    return np.array(sorted(acc_id for user, acc_id in rows if user in premium_users),
+                    dtype=np.int64)
+
+
+def accrue_chunk(balances, codes, premium, days, basic_rates, premium_rates,
+                 charge_mask=None, premium_cost=PREMIUM_COST):
+    """Return (interest, fees) arrays for one chunk; pure NumPy, no I/O"""
+    known = codes >= 0
+    safe_codes = np.where(known, codes, 0)
+    annual = np.where(premium, premium_rates[safe_codes], basic_rates[safe_codes])
+    annual = np.where(known, annual, 0.0)
+    interest = np.where(balances > 0, balances * annual * (days / DAYS_PER_YEAR), 0.0)
+
+    fees = np.zeros_like(balances)
+    if charge_mask is not None:
+        payable = charge_mask & (balances + interest >= premium_cost)
+        fees[payable] = premium_cost
+    return interest, fees
+
+
+def run(days=1, charge_premium=False, chunk_size=CHUNK_SIZE):
+    started = time.perf_counter()
+    now = datetime.datetime.now().isoformat()
+    basic_rates, premium_rates = _annual_rates(False), _annual_rates(True)
+    totals = {"accounts": 0, "updated": 0, "interest": 0.0, "fees": 0.0, "unpaid_fees": 0,
+              "already_charged": 0}
+
+    premium_users = active_premium_users()
+    for pool in db.data_pools():
+        _run_pool(pool, totals, now, days, premium_users, charge_premium, chunk_size,
+                  basic_rates, premium_rates)
+    totals["seconds"] = time.perf_counter() - started
+    return totals
+
+
+def _run_pool(pool, totals, now, days, premium_users, charge_premium, chunk_size,
+              basic_rates, premium_rates):
+    with pool.connection() as conn:
+        charge_ids = _charge_account_ids(conn, premium_users) if charge_premium else None
+    month = now[:7]
+
+    last_id = 0
+    while True:
+        # Read and write each chunk under one write lock, so a deposit or
+        # payment can't land between the read and the update
+        with pool.transaction(immediate=True) as conn:
+            rows = conn.execute("""SELECT account_id, username, account_type, balance, name
+                                   FROM accounts WHERE account_id > ? AND name IS NOT NULL
+                                   ORDER BY account_id LIMIT ?""",
+                                (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            n = len(rows)
+            ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+            balances = np.fromiter((r[3] or 0.0 for r in rows), dtype=np.float64, count=n)
+            codes = np.fromiter((TYPE_CODES.get(r[2], -1) for r in rows), dtype=np.int16, count=n)
+            premium = np.fromiter((r[1] in premium_users for r in rows), dtype=bool, count=n)
+            charge_mask = None
+            if charge_ids is not None:
+                charge_mask = np.isin(ids, charge_ids)
+                charged = _charged_this_month(conn, month,
+                                              [rows[i][1] for i in np.flatnonzero(charge_mask)])
+                if charged:
+                    done = np.fromiter((r[1] in charged for r in rows), dtype=bool, count=n)
+                    totals["already_charged"] += int(np.count_nonzero(charge_mask & done))
+                    charge_mask &= ~done
+
+            interest, fees = accrue_chunk(balances, codes, premium, days,
+                                          basic_rates, premium_rates, charge_mask)
+            deltas = interest - fees
+            changed = np.flatnonzero((interest != 0) | (fees != 0))
+
+            updates = list(zip(deltas[changed].tolist(), ids[changed].tolist()))
+            # Every balance change gets a ledger row naming its account (see reconcile.py)
+            ledger_rows = [(rows[i][1], f"interest on {rows[i][4]}", float(interest[i]), 0.0, now)
+                           for i in np.flatnonzero(interest).tolist()]
+            ledger_rows += [(rows[i][1], f"premium fee from {rows[i][4]}", 0.0, float(fees[i]), now)
+                            for i in np.flatnonzero(fees).tolist()]
+            charges = [(rows[i][1], month, int(ids[i]), float(fees[i]), now)
+                       for i in np.flatnonzero(fees).tolist()]
+
+            conn.executemany("UPDATE accounts SET balance = balance + ? WHERE account_id=?",
+                             updates)
+            if ledger_rows:
+                conn.executemany(ledger.INSERT_SQL, ledger_rows)
+            if charges:
+                conn.executemany("""INSERT INTO premium_charges
+                                    (username, month, account_id, amount, charged_at)
+                                    VALUES (?, ?, ?, ?, ?)""", charges)
+
+        totals["accounts"] += n
+        totals["updated"] += len(updates)
+        totals["interest"] += float(interest.sum())
+        totals["fees"] += float(fees.sum())
+        if charge_mask is not None:
+            totals["unpaid_fees"] += int(np.count_nonzero(charge_mask & (fees == 0)))
+        last_id = int(ids[-1])
+
+
+def _charged_this_month(conn, month, usernames):
+    """Which of usernames already paid month's premium fee (see premium_charges)"""
+    if not usernames:
+        return set()
+    rows = conn.execute("""SELECT username FROM premium_charges
+                           WHERE month = ? AND username IN (SELECT value FROM json_each(?))""",
+                        (month, json.dumps(usernames)))
+    return {row[0] for row in rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accrue interest and premium fees")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--days", type=int, default=1, help="days of interest to accrue")
+    parser.add_argument("--charge-premium", action="store_true",
+                        help=f"charge the monthly ${PREMIUM_COST:.2f} premium fee "
+                             f"(once per member per month)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--shards", type=int, default=db.SHARDS, help="number of shard files")
+    args = parser.parse_args(argv)
+
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    totals = run(args.days, args.charge_premium, args.chunk_size)
+    print(f"{totals['accounts']} accounts scanned, {totals['updated']} updated, "
+          f"interest ${totals['interest']:.2f}, fees ${totals['fees']:.2f}, "
+          f"{totals['unpaid_fees']} unpaid premium fee(s), {totals['already_charged']} already "
+          f"charged this month in {totals['seconds']:.2f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Group-commit writer for the transactions ledger.
+
+record() queues a row in memory; a background thread writes queued rows
+with one executemany + commit per batch. In durable mode callers block
+until their batch is committed, but every caller that arrived while the
+previous batch was being written shares the next commit. In relaxed mode
+record() returns immediately and batches flush on size or age.
+"""
+import atexit
+import datetime
+import threading
+import time
+
+import db
+import instrumentation
+
+BATCH_SIZE = 500
+DURABLE_FLUSH_INTERVAL = 0.0  # flush as soon as the writer is free
+RELAXED_FLUSH_INTERVAL = 0.25  # seconds a row may wait in relaxed mode
+
+INSERT_SQL = """INSERT INTO transactions (username, type, amount, fee, timestamp)
+                VALUES (?, ?, ?, ?, ?)"""
+
+
+class _Batch:
+    def __init__(self):
+        self.rows = []
+        self.started = None
+        self.done = threading.Event()
+        self.error = None
+
+
+class LedgerWriter:
+    def __init__(self, durable=True, batch_size=BATCH_SIZE, flush_interval=None):
+        self.durable = durable
+        self.batch_size = batch_size
+        if flush_interval is None:
+            flush_interval = DURABLE_FLUSH_INTERVAL if durable else RELAXED_FLUSH_INTERVAL
+        self.flush_interval = flush_interval
+        self._batch = _Batch()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._stats = {"flushes": 0, "rows_flushed": 0, "failed_rows": 0,
+                       "last_batch_size": 0, "last_flush_ms": 0.0,
+                       "max_flush_ms": 0.0, "total_flush_ms": 0.0}
+
+    def record(self, username, trans_type, amount, fee=0.0, timestamp=None):
+        if timestamp is None:
+            timestamp = datetime.datetime.now().isoformat()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Ledger writer is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+            batch = self._batch
+            if not batch.rows:
+                batch.started = time.monotonic()
+            batch.rows.append((username, trans_type, amount, fee, timestamp))
+            if len(batch.rows) >= self.batch_size or self.flush_interval <= 0:
+                self._cond.notify()
+        if self.durable:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+
+    def _due(self, now):
+        batch = self._batch
+        return bool(batch.rows) and (len(batch.rows) >= self.batch_size
+                                     or now - batch.started >= self.flush_interval)
+
+    def _take_batch(self):
+        batch, self._batch = self._batch, _Batch()
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due(time.monotonic()):
+                    timeout = None
+                    if self._batch.rows:
+                        timeout = max(0.0, self._batch.started + self.flush_interval - time.monotonic())
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take_batch()
+            self._write(batch)
+
+    def _write(self, batch):
+        if not batch.rows:
+            batch.done.set()
+            return
+        with self._write_lock:
+            start = time.perf_counter()
+            try:
+                # One commit per shard; unsharded this is a single commit
+                for pool, rows in db.group_by_user(batch.rows).items():
+                    with pool.transaction() as conn:
+                        conn.executemany(INSERT_SQL, rows)
+            except Exception as e:
+                batch.error = e
+                self._stats["failed_rows"] += len(batch.rows)
+                if not self.durable:
+                    print(f"Ledger flush failed, {len(batch.rows)} row(s) dropped: {e}")
+            else:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self._stats["flushes"] += 1
+                self._stats["rows_flushed"] += len(batch.rows)
+                self._stats["last_batch_size"] = len(batch.rows)
+                self._stats["last_flush_ms"] = elapsed_ms
+                self._stats["total_flush_ms"] += elapsed_ms
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+            finally:
+                batch.done.set()
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        with self._cond:
+            batch = self._take_batch()
+        self._write(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def metrics(self):
+        with self._cond:
+            depth = len(self._batch.rows)
+        stats = dict(self._stats)
+        total_ms = stats.pop("total_flush_ms")
+        stats["avg_flush_ms"] = total_ms / stats["flushes"] if stats["flushes"] else 0.0
+        stats["queue_depth"] = depth
+        stats["mode"] = "durable" if self.durable else "relaxed"
+        return stats
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LedgerWriter()
+        return _writer
+
+
+def configure(durable=True, batch_size=BATCH_SIZE, flush_interval=None):
+    """Replace the shared writer, flushing anything the old one had queued"""
+    global _writer
+    with _writer_lock:
+        old, _writer = _writer, LedgerWriter(durable, batch_size, flush_interval)
+    if old is not None:
+        old.close()
+    return _writer
+
+
+@instrumentation.timed("ledger.record")
+def record(username, trans_type, amount, fee=0.0, timestamp=None):
+    if db.in_transaction(username):
+        # Caller is mid-transaction (e.g. apply_operation): the row must commit with it
+        if timestamp is None:
+            timestamp = datetime.datetime.now().isoformat()
+        with db.connection(username) as conn:
+            conn.execute(INSERT_SQL, (username, trans_type, amount, fee, timestamp))
+    else:
+        get_writer().record(username, trans_type, amount, fee, timestamp)
+
+
+def flush():
+    if _writer is not None:
+        _writer.flush()
+
+
+def shutdown():
+    if _writer is not None:
+        _writer.close()
+
+
+def metrics():
+    return get_writer().metrics()
+
+
+atexit.register(shutdown)
+instrumentation.register_collector("ledger", lambda: _writer.metrics() if _writer else {})
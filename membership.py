@@ -0,0 +1,209 @@
+"""Premium membership lookups, upgrades and the renewal/expiry sweeper.
+
+While the sweeper thread runs, is_premium_user is a dict lookup against
+the published set of active members (username -> expiry_date), refreshed
+on every sweep and updated in place by upgrade_to_premium. Without the
+sweeper, lookups fall back to a small TTL/LRU cache of each user's
+expiry_date.
+"""
+import datetime
+import threading
+import time
+
+import db
+import instrumentation
+from cache import TTLCache
+
+PREMIUM_COST = 5.0  # $5/month
+PREMIUM_CACHE_TTL = 30.0  # seconds a premium lookup is reused
+PREMIUM_CACHE_SIZE = 1024
+MEMBERSHIP_DAYS = 30
+SWEEP_INTERVAL = 60.0  # seconds between sweeps
+EXPIRED_GRACE_DAYS = 7  # lapsed rows are purged after this many days
+
+# Cached membership lookups: username -> expiry_date (ISO string) or None
+_premium_cache = TTLCache(maxsize=PREMIUM_CACHE_SIZE, ttl=PREMIUM_CACHE_TTL)
+_NOT_CACHED = object()
+
+# Published by the sweeper: username -> expiry_date of every active member
+_active = None
+_pending = {}  # upgrades made while a sweep was reading
+_active_lock = threading.Lock()
+_sweeper = None
+
+
+def ensure_schema(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(premium_members)")]
+    if "auto_renew" not in columns:
+        conn.execute("ALTER TABLE premium_members ADD COLUMN auto_renew INTEGER DEFAULT 0")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_premium_expiry
+                    ON premium_members(expiry_date)""")
+
+
+def get_premium_expiry(username):
+    """Return the membership expiry_date string, or None if not a member"""
+    active = _active
+    if active is not None:
+        return active.get(username)
+    expiry = _premium_cache.get(username, _NOT_CACHED)
+    if expiry is _NOT_CACHED:
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT expiry_date FROM premium_members WHERE username=?", (username,))
+            row = c.fetchone()
+        expiry = row[0] if row else None
+        _premium_cache.set(username, expiry)
+    return expiry
+
+
+@instrumentation.timed("membership.is_premium_user")
+def is_premium_user(username):
+    expiry = get_premium_expiry(username)
+    if expiry is None:
+        return False
+    if expiry <= datetime.datetime.now().isoformat():
+        # Membership lapsed since it was cached or last swept
+        _premium_cache.invalidate(username)
+        return False
+    return True
+
+
+def active_premium_users():
+    """Set of currently active premium usernames (queries if no sweeper)"""
+    now = datetime.datetime.now().isoformat()
+    active = _active
+    if active is None:
+        active = _load_active(now)
+    return {user for user, expiry in active.items() if expiry > now}
+
+
+def invalidate_premium_cache(username=None):
+    if username is None:
+        _premium_cache.clear()
+    else:
+        _premium_cache.invalidate(username)
+
+
+def premium_cache_stats():
+    stats = _premium_cache.stats()
+    stats["active_set"] = None if _active is None else len(_active)
+    return stats
+
+
+@instrumentation.timed("membership.upgrade_to_premium")
+def upgrade_to_premium(username, auto_renew=False):
+    """Start a membership, or extend an active one by MEMBERSHIP_DAYS"""
+    today = datetime.datetime.now()
+    expiry = (today + datetime.timedelta(days=MEMBERSHIP_DAYS)).isoformat()
+
+    try:
+        with db.transaction() as conn:
+            # Renewing early stacks on top of the current expiry
+            conn.execute("""INSERT INTO premium_members (username, since_date, expiry_date, auto_renew)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT(username) DO UPDATE SET
+                                expiry_date = CASE WHEN expiry_date > excluded.since_date
+                                    THEN strftime('%Y-%m-%dT%H:%M:%f', expiry_date, ?)
+                                    ELSE excluded.expiry_date END,
+                                auto_renew = excluded.auto_renew""",
+                         (username, today.isoformat(), expiry, int(auto_renew),
+                          f"+{MEMBERSHIP_DAYS} days"))
+            new_expiry = conn.execute("SELECT expiry_date FROM premium_members WHERE username=?",
+                                      (username,)).fetchone()[0]
+        _publish_one(username, new_expiry)
+        return True
+    except:
+        return False
+    finally:
+        invalidate_premium_cache(username)
+
+
+def _publish_one(username, expiry):
+    with _active_lock:
+        if _active is not None:
+            _active[username] = expiry
+        _pending[username] = expiry
+
+
+def _load_active(now):
+    with db.connection() as conn:
+        rows = conn.execute("SELECT username, expiry_date FROM premium_members WHERE expiry_date > ?",
+                            (now,)).fetchall()
+    return dict(rows)
+
+
+def sweep():
+    """Renew due auto-renew memberships, purge long-lapsed ones, publish the rest"""
+    global _active
+    now = datetime.datetime.now()
+    now_iso = now.isoformat()
+    purge_before = (now - datetime.timedelta(days=EXPIRED_GRACE_DAYS)).isoformat()
+    renewed_expiry = (now + datetime.timedelta(days=MEMBERSHIP_DAYS)).isoformat()
+
+    with _active_lock:
+        _pending.clear()
+    with db.transaction(immediate=True) as conn:
+        renewed = conn.execute("""UPDATE premium_members SET expiry_date = ?
+                                  WHERE auto_renew = 1 AND expiry_date <= ?""",
+                               (renewed_expiry, now_iso)).rowcount
+        purged = conn.execute("""DELETE FROM premium_members
+                                 WHERE auto_renew = 0 AND expiry_date <= ?""",
+                              (purge_before,)).rowcount
+    fresh = _load_active(now_iso)
+    with _active_lock:
+        fresh.update(_pending)
+        _pending.clear()
+        _active = fresh
+    if renewed or purged:
+        _premium_cache.clear()
+    return {"renewed": renewed, "purged": purged, "active": len(fresh)}
+
+
+class MembershipSweeper(threading.Thread):
+    def __init__(self, interval=SWEEP_INTERVAL):
+        super().__init__(name="membership-sweeper", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                sweep()
+            except Exception as e:
+                print(f"Membership sweep failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    """Start the background sweeper once per process; later calls are no-ops"""
+    global _sweeper
+    with _active_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return _sweeper
+        _sweeper = MembershipSweeper(interval)
+    _sweeper.start()
+    return _sweeper
+
+
+def stop_sweeper():
+    """Stop sweeping and go back to per-user cached lookups"""
+    global _sweeper, _active
+    with _active_lock:
+        sweeper, _sweeper = _sweeper, None
+        _active = None
+    if sweeper is not None:
+        sweeper.stop()
+        sweeper.join()
+
+
+instrumentation.register_collector("premium_cache", premium_cache_stats)
+
+
+if __name__ == "__main__":
+    # Standalone sweeper process (e.g. under cron or a supervisor)
+    while True:
+        print(sweep())
+        time.sleep(SWEEP_INTERVAL)
@@ -1,14 +1,28 @@
 import streamlit as st
-import sqlite3
-import hashlib
-from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont  # Fixed import
+import ledger
+import session_cache
+import membership
+import schema
+import auth
+import payments
+import partner_offers
+import instrumentation
+import assets
+import velocity
+import os
+from auth import create_user, verify_user
+from membership import (PREMIUM_COST, get_premium_expiry, is_premium_user, upgrade_to_premium,
+                        invalidate_premium_cache, premium_cache_stats)
 import datetime
-from streamlit.components.v1 import html
+import time
+import uuid
+from footer import footer
 
 # Add these constants after imports
-PREMIUM_COST = 5.0  # $5/month
 # TRANSACTION_FEE_RATE = 0.01  # 1%
+# Comma-separated usernames who may open the ?admin=1 metrics panel
+ADMIN_USERS = {u for u in os.environ.get("BANK_ADMINS", "").split(",") if u}
+PAYMENT_RETRY_WINDOW = 3  # seconds a repeat click reuses the last payment's idempotency key
 PARTNER_OFFERS = {
     "XYZ Restaurant": "10% cashback",
     "ABC Cinema": "1 free ticket per month",
@@ -17,75 +31,16 @@ PARTNER_OFFERS = {
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('bank.db')
-    c = conn.cursor()
-    
-    # Create users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY, 
-                  password TEXT,
-                  full_name TEXT,
-                  email TEXT)''')
-    
-    # Create accounts table
-    c.execute('''CREATE TABLE IF NOT EXISTS accounts
-                 (account_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT,
-                  account_type TEXT,
-                  balance REAL DEFAULT 0.0,
-                  FOREIGN KEY(username) REFERENCES users(username))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS premium_members
-                 (username TEXT PRIMARY KEY,
-                  since_date TEXT,
-                  expiry_date TEXT,
-                  FOREIGN KEY(username) REFERENCES users(username))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS transactions
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT,
-                  type TEXT,
-                  amount REAL,
-                  fee REAL,
-                  timestamp TEXT,
-                  FOREIGN KEY(username) REFERENCES users(username))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS partner_usage
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT,
-                  partner_name TEXT,
-                  used INTEGER DEFAULT 0,
-                  FOREIGN KEY(username) REFERENCES users(username))''')
+    """Create or upgrade the schema (runs once per process)"""
+    schema.ensure()
 
-    
-    conn.commit()
-    conn.close()
 
-init_db()
-def is_premium_user(username):
-    conn = sqlite3.connect('bank.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM premium_members WHERE username=? AND expiry_date > ?", 
-             (username, datetime.datetime.now().isoformat()))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
-
-def upgrade_to_premium(username):
-    conn = sqlite3.connect('bank.db')
-    c = conn.cursor()
-    today = datetime.datetime.now()
-    expiry = today + datetime.timedelta(days=30)  # 1 month
-    
-    try:
-        c.execute("INSERT INTO premium_members VALUES (?, ?, ?)",
-                 (username, today.isoformat(), expiry.isoformat()))
-        conn.commit()
-        return True
-    except:
-        return False
-    finally:
-        conn.close()
+def startup():
+    """Per-process setup; cheap to call on every rerun"""
+    init_db()
+    membership.start_sweeper()
+    assets.preload()
+    velocity.ensure_rebuilt()
 
 # def record_transaction(username, trans_type, amount, fee=0.0):
 #     conn = sqlite3.connect('bank.db')
@@ -94,30 +49,37 @@ def upgrade_to_premium(username):
 #              (username, trans_type, amount, fee, datetime.datetime.now().isoformat()))
 #     conn.commit()
 #     conn.close()
+@instrumentation.timed("db.record_transaction")
 def record_transaction(username, trans_type, amount, fee=0.0):
     try:
-        conn = sqlite3.connect('bank.db')
-        c = conn.cursor()
-        timestamp = datetime.datetime.now().isoformat()
-        c.execute("""
-            INSERT INTO transactions 
-            (username, type, amount, fee, timestamp) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (username, trans_type, amount, fee, timestamp))
-        conn.commit()
+        ledger.record(username, trans_type, amount, fee)
     except Exception as e:
         st.error(f"Failed to record transaction: {e}")
-    finally:
-        conn.close()
+
+AD_HTML = """
+<div style="border:1px solid #ccc; padding:10px; margin:10px 0; border-radius:5px;">
+    <p style="color:gray; font-size:small;">Advertisement</p>
+    <p>Special offer: Get 20% off on XYZ Services!</p>
+</div>
+"""
 
 def show_ads():
     """Simulated ad display"""
-    html("""
-    <div style="border:1px solid #ccc; padding:10px; margin:10px 0; border-radius:5px;">
-        <p style="color:gray; font-size:small;">Advertisement</p>
-        <p>Special offer: Get 20% off on XYZ Services!</p>
-    </div>
-    """)
+    from streamlit.components.v1 import html  # only basic members see ads
+    html(AD_HTML)
+
+def show_partner_offers(username):
+    """Sidebar offers; redemptions are counted against each partner's limit"""
+    st.sidebar.subheader("Partner Offers")
+    for partner, offer in PARTNER_OFFERS.items():
+        with st.sidebar.expander(f"{partner}: {offer}"):
+            st.write(f"Show this offer at {partner} to get {offer}")
+            if st.button(f"Use {partner} Offer"):
+                if partner_offers.redeem(username, partner):
+                    st.success(f"Offer activated! Visit {partner} to claim your {offer}")
+                else:
+                    st.warning(f"You've already used your {partner} offer this period.")
+            st.caption(f"{partner_offers.remaining(username, partner)} use(s) left")
 
 # Modify the run_bank_account function
 def run_bank_account(username):
@@ -126,11 +88,7 @@ def run_bank_account(username):
     
     # Premium account upsell
     if is_premium_user(username):
-        conn = sqlite3.connect('bank.db')
-        c = conn.cursor()
-        c.execute("SELECT expiry_date FROM premium_members WHERE username=?", (username,))
-        expiry = datetime.datetime.fromisoformat(c.fetchone()[0])
-        conn.close()
+        expiry = datetime.datetime.fromisoformat(get_premium_expiry(username))
     
     days_left = (expiry - datetime.datetime.now()).days
     if days_left <= 7:
@@ -149,12 +107,7 @@ def run_bank_account(username):
                 st.sidebar.error("Upgrade failed. Please try again.")
     
     # Partner offers section
-    st.sidebar.subheader("Partner Offers")
-    for partner, offer in PARTNER_OFFERS.items():
-        with st.sidebar.expander(f"{partner}: {offer}"):
-            st.write(f"Show this offer at {partner} to get {offer}")
-            if st.button(f"Use {partner} Offer"):
-                st.success(f"Offer activated! Visit {partner} to claim your {offer}")
+    show_partner_offers(username)
     
     # Show ads for non-premium users
     if not is_premium_user(username):
@@ -173,81 +126,59 @@ def apply_premium_benefits(username, account_type, balance):
 
 
 # Logo and styling
+@instrumentation.timed("logo.load")
 def load_logo():
-    try:
-        # Try to open existing logo
-        return Image.open("NBank.png")
-    except FileNotFoundError:
-        # Create a simple logo if file doesn't exist
-        img = Image.new('RGB', (200, 100), color=(42, 92, 170))
-        d = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            font = ImageFont.load_default()
-        d.text((10,10), "ProfitPeak", fill=(255,215,0), font=font)
-        img.save("NBank.png")
-        return img
+    # PNG bytes rendered once per process (see assets.py)
+    return assets.logo_bytes(200)
 
         
-def add_funds(username, amount):
-    """Add funds to user's primary account"""
-    conn = sqlite3.connect('bank.db')
-    c = conn.cursor()
+@instrumentation.timed("db.add_funds")
+def add_funds(username, amount, key=None):
+    """Add funds to user's primary account
+
+    Goes through the payments queue: the balance, ledger row and the
+    idempotency key commit together, so a repeated key is not applied
+    twice. Returns a payments status, or None if the payment failed.
+    """
     try:
-        # Get user's first account
-        c.execute("SELECT account_id FROM accounts WHERE username=? LIMIT 1", (username,))
-        account_id = c.fetchone()[0]
-        
-        # Update balance
-        c.execute("UPDATE accounts SET balance = balance + ? WHERE account_id=?", 
-                 (amount, account_id))
-        
-        # Record transaction
-        record_transaction(username, "deposit", amount)
-        conn.commit()
-        return True
+        status = payments.submit(username, amount, key or uuid.uuid4().hex).wait()
+        if status == payments.APPLIED:
+            session_cache.invalidate(username)
+        return status
     except Exception as e:
         print(f"Error adding funds: {e}")
-        return False
-    finally:
-        conn.close()
+        return None
+
+def _payment_intent(amount):
+    """Idempotency key for the next payment of this amount
+
+    A double-click or rerun shortly after a payment reuses its key, so the
+    repeat is rejected as a duplicate instead of charging twice.
+    """
+    intent = st.session_state.get("payment_intent")
+    if (intent is None or intent["amount"] != amount
+            or (intent["paid_at"] and time.time() - intent["paid_at"] > PAYMENT_RETRY_WINDOW)):
+        intent = {"amount": amount, "key": uuid.uuid4().hex, "paid_at": None}
+        st.session_state.payment_intent = intent
+    return intent
 
 def simulate_payment(username, amount):
     """Simulate payment processing"""
+    intent = _payment_intent(amount)
     if st.button(f"Add ${amount} via Paypal/Stripe"):
-        if add_funds(username, amount):
+        status = add_funds(username, amount, intent["key"])
+        if status == payments.APPLIED:
+            intent["paid_at"] = time.time()
             st.success(f"${amount} added successfully! (Simulated)")
             st.rerun()
+        elif status == payments.DUPLICATE:
+            st.info("This payment was already applied.")
+        elif status == payments.NO_ACCOUNT:
+            st.error("Open an account before adding funds")
         else:
             st.error("Failed to add funds")
 
 
-# Authentication functions
-def create_user(username, password, full_name, email):
-    conn = sqlite3.connect('bank.db')
-    c = conn.cursor()
-    hashed_pwd = hashlib.sha256(password.encode()).hexdigest()
-    try:
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?)", 
-                 (username, hashed_pwd, full_name, email))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
-
-def verify_user(username, password):
-    conn = sqlite3.connect('bank.db')
-    c = conn.cursor()
-    hashed_pwd = hashlib.sha256(password.encode()).hexdigest()
-    c.execute("SELECT * FROM users WHERE username=? AND password=?", 
-             (username, hashed_pwd))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
-
 def run_bank_account(username):
     """Function to run the banking system after login"""
     from Bank_account import main as bank_main
@@ -287,12 +218,7 @@ def run_bank_account(username):
             else:
                 st.sidebar.error("Upgrade failed. Please try again.")
         # Partner offers section
-    st.sidebar.subheader("Partner Offers")
-    for partner, offer in PARTNER_OFFERS.items():
-        with st.sidebar.expander(f"{partner}: {offer}"):
-            st.write(f"Show this offer at {partner} to get {offer}")
-            if st.button(f"Use {partner} Offer"):
-                st.success(f"Offer activated! Visit {partner} to claim your {offer}")
+    show_partner_offers(username)
     
     # Show ads for non-premium users
     if not is_premium_user(username):
@@ -301,6 +227,32 @@ def run_bank_account(username):
     
     bank_main(username)  # Pass the username to Bank_account.py
 
+def show_admin_panel():
+    """Metrics for operators; only shown with ?admin=1 to users in ADMIN_USERS"""
+    if st.query_params.get("admin") != "1" or st.session_state.get("username") not in ADMIN_USERS:
+        return
+    with st.expander("🔧 Performance"):
+        renders = instrumentation.recent_renders()
+        if renders:
+            last = renders[-1]
+            st.write(f"Last render: {last['elapsed_ms']:.1f} ms, {last['queries']} queries")
+            st.table([{"call": name, "count": count, "total_ms": round(total, 2)}
+                      for name, (count, total) in sorted(last["calls"].items(),
+                                                         key=lambda item: -item[1][1])])
+            if last["profile"]:
+                st.code(last["profile"])
+
+        modes = [None, "cprofile", "tracemalloc"]
+        mode = st.selectbox("Profile next renders", modes,
+                            index=modes.index(instrumentation.get_profile_mode()),
+                            format_func=lambda m: m or "off")
+        if mode != instrumentation.get_profile_mode():
+            instrumentation.set_profile_mode(mode)
+
+        metrics = instrumentation.prometheus_text()
+        st.download_button("Download metrics", metrics, file_name="metrics.txt")
+        st.code(metrics)
+
 # Main app
 def main():
     st.set_page_config(
@@ -308,6 +260,7 @@ def main():
         page_icon="🏦",
         layout="centered"
     )
+    startup()
     
     logo = load_logo()
     st.image(logo, width=200)
@@ -328,9 +281,11 @@ def main():
                 username = st.text_input("Username")
                 password = st.text_input("Password", type="password")
                 if st.form_submit_button("Login"):
-                    if verify_user(username, password):
+                    token = auth.login(username, password)
+                    if token:
                         st.session_state.logged_in = True
                         st.session_state.username = username
+                        st.session_state.auth_token = token
                         st.rerun()
                     else:
                         st.error("Invalid username or password")
@@ -353,8 +308,15 @@ def main():
                         st.error("Username already exists")
     
     # After login - run the banking system
+    elif auth.session_user(st.session_state.get("auth_token")) != st.session_state.username:
+        # Session token lapsed: ask for the password again
+        st.session_state.logged_in = False
+        st.rerun()
     else:
         run_bank_account(st.session_state.username)
+    footer()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with instrumentation.render():
+        main()
+    show_admin_panel()
\ No newline at end of file
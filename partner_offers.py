@@ -0,0 +1,230 @@
+"""Partner-offer redemptions with per-period limits.
+
+    redeem("alice", "ABC Cinema")      # -> True, or False once the limit is hit
+    remaining("alice", "ABC Cinema")   # -> redemptions left this period
+    python partner_offers.py report --period 2024-05
+
+Counts live in memory, keyed by (username, partner, period), so a limit
+check is a dictionary lookup; the stored count is read from partner_usage
+the first time a key is seen. Redemptions add to a pending delta that a
+background thread writes every FLUSH_INTERVAL seconds (or sooner once
+FLUSH_BATCH are waiting) as one batch of upserts per shard on the unique
+(username, partner_name, period) index, so a burst of clicks costs one
+write, not one per click.
+
+Limits are enforced per process: several app processes each start from
+the stored count and can together go over by what they haven't flushed.
+"""
+import argparse
+import atexit
+import datetime
+import threading
+
+import db
+import instrumentation
+import schema
+
+MONTH = "month"
+LIFETIME = "lifetime"
+
+# partner -> (redemptions allowed, period they reset on)
+OFFER_LIMITS = {
+    "XYZ Restaurant": (4, MONTH),
+    "ABC Cinema": (1, MONTH),
+    "QuickDelivery": (1, LIFETIME),
+}
+DEFAULT_LIMIT = (1, MONTH)
+
+FLUSH_INTERVAL = 1.0  # seconds
+FLUSH_BATCH = 1000  # pending redemptions that trigger an early flush
+
+UPSERT_SQL = """INSERT INTO partner_usage (username, partner_name, period, used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(username, partner_name, period) DO UPDATE SET
+                    used = used + excluded.used"""
+
+
+def ensure_schema(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(partner_usage)")]
+    if "period" not in columns:
+        conn.execute("ALTER TABLE partner_usage ADD COLUMN period TEXT")
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_partner_usage_period
+                    ON partner_usage(username, partner_name, period)""")
+
+
+def current_period(period_kind, today=None):
+    if period_kind == LIFETIME:
+        return LIFETIME
+    return (today or datetime.date.today()).strftime("%Y-%m")
+
+
+class RedemptionCounter:
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._counts = {}  # (username, partner, period) -> [stored, pending]
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._stats = {"redeemed": 0, "rejected": 0, "flushes": 0, "rows_written": 0,
+                       "failed_flushes": 0}
+
+    def _load(self, key):
+        username, partner, period = key
+        with db.connection(username) as conn:
+            row = conn.execute("""SELECT used FROM partner_usage
+                                  WHERE username=? AND partner_name=? AND period=?""",
+                               key).fetchone()
+        return row[0] if row else 0
+
+    def _entry(self, key):
+        entry = self._counts.get(key)
+        if entry is None:
+            stored = self._load(key)  # first sight of this key only
+            with self._cond:
+                entry = self._counts.setdefault(key, [stored, 0])
+        return entry
+
+    def used(self, username, partner):
+        period = current_period(OFFER_LIMITS.get(partner, DEFAULT_LIMIT)[1])
+        stored, pending = self._entry((username, partner, period))
+        return stored + pending
+
+    def redeem(self, username, partner):
+        """Count one redemption if the limit allows it; returns True if counted"""
+        limit, period_kind = OFFER_LIMITS.get(partner, DEFAULT_LIMIT)
+        key = (username, partner, current_period(period_kind))
+        entry = self._entry(key)
+        with self._cond:
+            if entry[0] + entry[1] >= limit:
+                self._stats["rejected"] += 1
+                return False
+            entry[1] += 1
+            self._pending += 1
+            self._stats["redeemed"] += 1
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="partner-usage", daemon=True)
+                self._thread.start()
+            if self._pending >= self.flush_batch:
+                self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Write every pending delta; failed rows stay pending for the next try"""
+        with self._flush_lock:
+            with self._cond:
+                rows = [(key, entry[1]) for key, entry in self._counts.items() if entry[1]]
+            if not rows:
+                return 0
+            groups = {}
+            for key, delta in rows:
+                groups.setdefault(db.pool_for(key[0]), []).append((key, delta))
+            written = 0
+            for pool, part in groups.items():
+                try:
+                    with pool.transaction() as conn:
+                        conn.executemany(UPSERT_SQL, [key + (delta,) for key, delta in part])
+                except Exception as e:
+                    self._stats["failed_flushes"] += 1
+                    print(f"Partner usage flush failed, will retry: {e}")
+                    continue
+                with self._cond:
+                    for key, delta in part:
+                        entry = self._counts[key]
+                        entry[0] += delta
+                        entry[1] -= delta  # redemptions since the snapshot stay pending
+                        self._pending -= delta
+                written += len(part)
+            with self._cond:
+                self._stats["flushes"] += 1
+                self._stats["rows_written"] += written
+                self._prune()
+            return written
+
+    def _prune(self):
+        # Old months can't be redeemed against any more; forget flushed ones
+        this_month = current_period(MONTH)
+        stale = [key for key, entry in self._counts.items()
+                 if key[2] not in (this_month, LIFETIME) and not entry[1]]
+        for key in stale:
+            del self._counts[key]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def metrics(self):
+        with self._cond:
+            stats = dict(self._stats, pending=self._pending, keys=len(self._counts))
+        return stats
+
+
+_counter = RedemptionCounter()
+
+
+def redeem(username, partner):
+    return _counter.redeem(username, partner)
+
+
+def used(username, partner):
+    return _counter.used(username, partner)
+
+
+def remaining(username, partner):
+    limit = OFFER_LIMITS.get(partner, DEFAULT_LIMIT)[0]
+    return max(0, limit - _counter.used(username, partner))
+
+
+def flush():
+    return _counter.flush()
+
+
+atexit.register(_counter.close)
+instrumentation.register_collector("partner_offers", _counter.metrics)
+
+
+def usage_report(period=None):
+    """{partner: [users, redemptions]} for a period (default: this month)"""
+    import shards
+    period = period or current_period(MONTH)
+    return shards.aggregate("""SELECT partner_name, COUNT(*), TOTAL(used) FROM partner_usage
+                               WHERE period = ? GROUP BY partner_name""",
+                            (period,), group_by=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Partner offer usage")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS)
+    sub = parser.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="users and redemptions per partner")
+    rep.add_argument("--period", help="YYYY-MM or 'lifetime' (default: this month)")
+    args = parser.parse_args(argv)
+
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    period = args.period or current_period(MONTH)
+    print(f"Partner usage for {period}")
+    for partner, (users, redemptions) in sorted(usage_report(period).items()):
+        print(f"  {partner:<20}{users:>6} users{int(redemptions):>8} redemptions")
+
+
+if __name__ == "__main__":
+    main()
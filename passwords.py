@@ -0,0 +1,124 @@
+"""Salted password hashing with selectable KDFs.
+
+Hashes are stored as self-describing strings:
+
+    pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+    scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+
+Bare 64-character hex strings are the old unsalted SHA-256 hashes; they
+still verify, and needs_rehash() reports them so the caller can upgrade
+them at the next successful login.
+
+    python passwords.py --target-ms 250   # pick cost parameters for this host
+"""
+import argparse
+import hashlib
+import hmac
+import os
+import time
+
+DEFAULT_ALGORITHM = "pbkdf2_sha256"
+PBKDF2_ITERATIONS = 600_000
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+
+def configure(algorithm=None, pbkdf2_iterations=None, scrypt_n=None):
+    global DEFAULT_ALGORITHM, PBKDF2_ITERATIONS, SCRYPT_N
+    if algorithm is not None:
+        if algorithm not in ("pbkdf2_sha256", "scrypt"):
+            raise ValueError(f"Unknown password algorithm: {algorithm}")
+        DEFAULT_ALGORITHM = algorithm
+    if pbkdf2_iterations is not None:
+        PBKDF2_ITERATIONS = pbkdf2_iterations
+    if scrypt_n is not None:
+        SCRYPT_N = scrypt_n
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * n * r * p + 1024 * 1024, dklen=32)
+
+
+def hash_password(password, algorithm=None):
+    algorithm = algorithm or DEFAULT_ALGORITHM
+    salt = os.urandom(SALT_BYTES)
+    if algorithm == "pbkdf2_sha256":
+        digest = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+    if algorithm == "scrypt":
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    raise ValueError(f"Unknown password algorithm: {algorithm}")
+
+
+def legacy_hash(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def verify_password(password, encoded):
+    """Check password against a stored hash
+
+    hashlib's KDFs release the GIL, so running this inline in a Streamlit
+    script thread (or the API's DB pool) doesn't stall other sessions.
+    """
+    if not encoded:
+        return False
+    parts = encoded.split("$")
+    if len(parts) == 1:
+        expected, actual = encoded, legacy_hash(password)
+    elif parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+        expected = parts[3]
+        actual = _pbkdf2(password, bytes.fromhex(parts[2]), int(parts[1])).hex()
+    elif parts[0] == "scrypt" and len(parts) == 6:
+        n, r, p = (int(x) for x in parts[1:4])
+        expected = parts[5]
+        actual = _scrypt(password, bytes.fromhex(parts[4]), n, r, p).hex()
+    else:
+        return False
+    return hmac.compare_digest(expected, actual)
+
+
+def needs_rehash(encoded):
+    """True for legacy hashes and hashes weaker than the current settings"""
+    parts = encoded.split("$")
+    if parts[0] != DEFAULT_ALGORITHM:
+        return True
+    if parts[0] == "pbkdf2_sha256":
+        return int(parts[1]) < PBKDF2_ITERATIONS
+    return int(parts[1]) < SCRYPT_N
+
+
+def calibrate(target_ms=250.0, algorithm="pbkdf2_sha256"):
+    """Return the cost parameter whose hash time is closest to target_ms"""
+    salt = os.urandom(SALT_BYTES)
+    if algorithm == "pbkdf2_sha256":
+        probe = 50_000
+        start = time.perf_counter()
+        _pbkdf2("calibrate", salt, probe)
+        per_iteration = (time.perf_counter() - start) / probe
+        return max(100_000, int(target_ms / 1000 / per_iteration) // 10_000 * 10_000)
+    # scrypt cost must be a power of two: double n until we pass the target
+    n = 2 ** 12
+    while True:
+        start = time.perf_counter()
+        _scrypt("calibrate", salt, n, SCRYPT_R, SCRYPT_P)
+        if (time.perf_counter() - start) * 1000 >= target_ms or n >= 2 ** 20:
+            return n
+        n *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick KDF cost for a target login latency")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    args = parser.parse_args()
+    iterations = calibrate(args.target_ms, "pbkdf2_sha256")
+    n = calibrate(args.target_ms, "scrypt")
+    print(f"pbkdf2_sha256: PBKDF2_ITERATIONS = {iterations}")
+    print(f"scrypt: SCRYPT_N = {n}")
@@ -0,0 +1,239 @@
+"""Idempotent deposit ingestion for card/wallet top-ups.
+
+    ingest("alice", 50, key)                     # apply now in this thread
+    submit("alice", 50, key).wait()              # via the batching queue
+    python payments.py --count 50000 --dup-rate 0.1   # simulated provider load
+
+Every payment carries an idempotency key (the provider's payment id, or
+one the UI keeps across double-clicks). The key goes into `payments`
+under a unique (username, idempotency_key) index in the same commit as
+the balance update and the ledger row, so a retried or redelivered
+payment is recorded as a duplicate instead of being applied twice.
+
+The queue absorbs bursts: a worker thread drains up to BATCH_SIZE
+payments at a time and applies each shard's share in one transaction.
+The queue is bounded, so a provider that outruns the database blocks in
+submit() instead of growing memory without limit.
+"""
+import argparse
+import atexit
+import datetime
+import math
+import queue
+import random
+import threading
+import time
+import uuid
+
+import db
+import instrumentation
+import ledger
+import schema
+
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+NO_ACCOUNT = "no_account"
+
+BATCH_SIZE = 500
+QUEUE_SIZE = 10000
+RESULT_TIMEOUT = 10.0  # seconds submit(...).wait() blocks by default
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS payments
+                    (username TEXT NOT NULL,
+                     idempotency_key TEXT NOT NULL,
+                     amount REAL NOT NULL,
+                     provider TEXT,
+                     account_id INTEGER,
+                     created_at TEXT)""")
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_key
+                    ON payments(username, idempotency_key)""")
+
+
+def _apply(conn, username, amount, key, provider, now):
+    """Apply one payment inside the caller's transaction; returns its status"""
+    row = conn.execute("""SELECT account_id, name FROM accounts WHERE username=?
+                          ORDER BY account_id LIMIT 1""", (username,)).fetchone()
+    if row is None:
+        # Nothing recorded, so the same key can be retried once an account exists
+        return NO_ACCOUNT
+    inserted = conn.execute("""INSERT INTO payments (username, idempotency_key, amount, provider,
+                                                     account_id, created_at)
+                               VALUES (?, ?, ?, ?, ?, ?)
+                               ON CONFLICT(username, idempotency_key) DO NOTHING""",
+                            (username, key, amount, provider, row[0], now)).rowcount
+    if not inserted:
+        return DUPLICATE
+    conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id=?", (amount, row[0]))
+    conn.execute(ledger.INSERT_SQL, (username, f"deposit to {row[1]}", amount, 0.0, now))
+    return APPLIED
+
+
+@instrumentation.timed("payments.ingest")
+def ingest(username, amount, key, provider="simulated"):
+    """Apply one payment in a single commit; returns APPLIED/DUPLICATE/NO_ACCOUNT"""
+    if not (amount > 0 and math.isfinite(amount)):
+        raise ValueError("amount must be a positive number")
+    now = datetime.datetime.now().isoformat()
+    with db.transaction(immediate=True, username=username) as conn:
+        return _apply(conn, username, amount, key, provider, now)
+
+
+class PaymentResult:
+    def __init__(self, payment):
+        self.payment = payment  # (username, amount, key, provider)
+        self.status = None
+        self.error = None
+        self._done = threading.Event()
+
+    def _set(self, status=None, error=None):
+        self.status, self.error = status, error
+        self._done.set()
+
+    def wait(self, timeout=RESULT_TIMEOUT):
+        if not self._done.wait(timeout):
+            raise TimeoutError("Payment is still queued")
+        if self.error is not None:
+            raise self.error
+        return self.status
+
+
+class PaymentQueue:
+    def __init__(self, batch_size=BATCH_SIZE, maxsize=QUEUE_SIZE):
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, APPLIED: 0, DUPLICATE: 0, NO_ACCOUNT: 0, "failed": 0,
+                       "batches": 0, "max_batch": 0}
+
+    def submit(self, username, amount, key, provider="simulated"):
+        if not (amount > 0 and math.isfinite(amount)):
+            raise ValueError("amount must be a positive number")
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="payment-ingest", daemon=True)
+                self._thread.start()
+            self._stats["submitted"] += 1
+        result = PaymentResult((username, amount, key, provider))
+        self._queue.put(result)
+        return result
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:  # close(): finish what was queued before it, then stop
+                stopping = True
+                batch = batch[:batch.index(None)]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        now = datetime.datetime.now().isoformat()
+        groups = {}
+        for result in batch:
+            groups.setdefault(db.pool_for(result.payment[0]), []).append(result)
+        for pool, results in groups.items():
+            try:
+                with pool.transaction(immediate=True) as conn:
+                    statuses = [_apply(conn, *r.payment, now) for r in results]
+            except Exception:
+                # One bad payment must not sink the batch: retry them one by one
+                statuses = None
+            for i, result in enumerate(results):
+                if statuses is not None:
+                    result._set(statuses[i])
+                    continue
+                try:
+                    result._set(ingest(*result.payment))
+                except Exception as e:
+                    result._set(error=e)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+            for result in batch:
+                key = "failed" if result.error is not None else result.status
+                self._stats[key] += 1
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = PaymentQueue()
+        return _queue
+
+
+def submit(username, amount, key, provider="simulated"):
+    return get_queue().submit(username, amount, key, provider)
+
+
+def shutdown():
+    if _queue is not None:
+        _queue.close()
+
+
+atexit.register(shutdown)
+instrumentation.register_collector("payments", lambda: _queue.metrics() if _queue else {})
+
+
+def simulate_provider(usernames, count, dup_rate=0.05, amounts=(10, 20, 50, 100, 200, 500)):
+    """Push count payment webhooks through the queue, redelivering some keys"""
+    sent, results = [], []
+    for _ in range(count):
+        if sent and random.random() < dup_rate:
+            payment = random.choice(sent)  # provider retry of an earlier delivery
+        else:
+            payment = (random.choice(usernames), random.choice(amounts), uuid.uuid4().hex)
+            sent.append(payment)
+        results.append(submit(*payment))
+    return [r.wait() for r in results]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated payment provider load")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS)
+    parser.add_argument("--count", type=int, default=10000, help="webhooks to deliver")
+    parser.add_argument("--dup-rate", type=float, default=0.05, help="share of redelivered webhooks")
+    args = parser.parse_args(argv)
+
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    with db.connection() as conn:
+        usernames = [row[0] for row in conn.execute("SELECT username FROM users")]
+    if not usernames:
+        raise SystemExit("No users to pay into")
+    started = time.perf_counter()
+    statuses = simulate_provider(usernames, args.count, args.dup_rate)
+    elapsed = time.perf_counter() - started
+    counts = {status: statuses.count(status) for status in (APPLIED, DUPLICATE, NO_ACCOUNT)}
+    print(f"{args.count} payments in {elapsed:.2f}s ({args.count / elapsed:,.0f}/sec): {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Ledger reconciliation: replay each user's transactions and compare.
+
+    python reconcile.py                          # verify users changed since the last run
+    python reconcile.py --full --workers 8       # verify everyone
+    python reconcile.py --report drift.jsonl --json-dir .
+
+For every user the ledger is replayed in (timestamp, id) order with the
+same rules as snapshots.py, and the result is compared with what is stored:
+
+    ledger_balance   ledger_balances row (balance, fees, count) vs the replay
+    statement        each monthly statements row vs the replayed month
+    account_balance  the user's summed account balances vs the replayed
+                     balance (opening balances, deposits, interest, fees)
+    negative_balance an account below zero
+    json_stale       a legacy accounts_<user>.json balance that differs from
+                     the accounts table (only with --json-dir)
+
+Every balance change writes a ledger row naming its account, opening
+balances included, so the replay has to land on what the accounts table
+holds. The check is per user: transfer fees sit on the "Transfer to" row,
+which names only the receiving account. History bulk-imported without
+matching balances (bulk_io.py) shows up here as account_balance drift.
+snapshots.rebuild() fixes the first two kinds.
+Months moved to archive files (archive.py) are closed: their statements
+are taken as they are and the replay continues from them.
+
+Users are split into chunks and verified in a process pool. Each shard
+keeps a reconcile_state row per user (last transaction id, row count and
+account totals when last verified); users whose fingerprint hasn't changed
+since a clean check are skipped, so repeat runs only look at recent
+activity. Edits to ledger_balances or statements alone don't change the
+fingerprint; schedule an occasional --full run to catch those. Exit
+status is 1 if anything was found.
+"""
+import argparse
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import archive
+import db
+import schema
+
+CHUNK_SIZE = 500
+TOLERANCE = 0.005  # half a cent
+
+
+def ensure_schema(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS reconcile_state
+                    (username TEXT PRIMARY KEY,
+                     max_id INTEGER,
+                     txn_count INTEGER,
+                     accounts_total REAL,
+                     account_count INTEGER,
+                     verified_at TEXT,
+                     ok INTEGER)""")
+
+
+def delta(trans_type, amount, fee):
+    """Balance effect of one ledger row (same rules as snapshots.DELTA_SQL)"""
+    kind = trans_type.lower()
+    if kind.startswith(("deposit", "interest")):
+        change = amount
+    elif kind.startswith("withdraw"):
+        change = -amount
+    else:
+        change = 0.0
+    return change - (fee or 0.0)
+
+
+def replay(rows, balance=0.0, fees=0.0, count=0):
+    """(totals, {month: statement}) for one user's rows in (timestamp, id) order
+
+    balance, fees and count carry over from months already closed.
+    """
+    months = {}
+    for trans_type, amount, fee, timestamp in rows:
+        amount = amount or 0.0
+        month = timestamp[:7]
+        stmt = months.get(month)
+        if stmt is None:
+            stmt = months[month] = {"opening_balance": balance, "deposits": 0.0,
+                                    "withdrawals": 0.0, "fees": 0.0, "txn_count": 0}
+        change = delta(trans_type, amount, fee)
+        kind = trans_type.lower()
+        if kind.startswith(("deposit", "interest")):
+            stmt["deposits"] += amount
+        elif kind.startswith("withdraw"):
+            stmt["withdrawals"] += amount
+        stmt["fees"] += fee or 0.0
+        stmt["txn_count"] += 1
+        balance += change
+        fees += fee or 0.0
+        stmt["closing_balance"] = balance
+    return {"balance": balance, "fees": fees, "txn_count": count + len(rows)}, months
+
+
+def _differs(expected, actual):
+    return actual is None or abs((expected or 0.0) - actual) > TOLERANCE
+
+
+def _compare(username, totals, months, stored_totals, stored_months):
+    found = []
+    if totals["txn_count"] or stored_totals:
+        stored = stored_totals or {"balance": None, "fees": None, "txn_count": None}
+        if (_differs(totals["balance"], stored["balance"]) or _differs(totals["fees"], stored["fees"])
+                or totals["txn_count"] != stored["txn_count"]):
+            found.append({"username": username, "kind": "ledger_balance",
+                          "expected": totals, "actual": stored_totals})
+    for month in sorted(set(months) | set(stored_months)):
+        expected, actual = months.get(month), stored_months.get(month)
+        if expected is None or actual is None or any(
+                _differs(expected[k], actual[k]) for k in expected if k != "txn_count") \
+                or expected["txn_count"] != actual["txn_count"]:
+            found.append({"username": username, "kind": "statement", "month": month,
+                          "expected": expected, "actual": actual})
+    return found
+
+
+def verify_chunk(shard, usernames):
+    """Worker: verify a chunk of users on one shard (-1 = unsharded bank.db)
+
+    Returns (discrepancies, state rows for reconcile_state).
+    """
+    pool = db.get_pool() if shard < 0 else db.shard_pool(shard)
+    archived = set(archive.archived_months())
+    marks = ", ".join("?" * len(usernames))
+    with pool.connection() as conn:
+        ledger_rows = conn.execute(f"""SELECT username, type, amount, fee, timestamp, id
+                                       FROM transactions WHERE username IN ({marks})
+                                       ORDER BY username, timestamp, id""", usernames).fetchall()
+        balances = conn.execute(f"""SELECT username, balance, fees, txn_count FROM ledger_balances
+                                    WHERE username IN ({marks})""", usernames).fetchall()
+        statements = conn.execute(f"""SELECT username, month, opening_balance, closing_balance,
+                                             deposits, withdrawals, fees, txn_count
+                                      FROM statements WHERE username IN ({marks})""",
+                                  usernames).fetchall()
+        accounts = conn.execute(f"""SELECT username, name, balance FROM accounts
+                                    WHERE username IN ({marks})""", usernames).fetchall()
+
+    by_user = {u: [] for u in usernames}
+    max_ids, hot_counts = {}, {}
+    for username, trans_type, amount, fee, timestamp, row_id in ledger_rows:
+        max_ids[username] = max(max_ids.get(username, 0), row_id)
+        hot_counts[username] = hot_counts.get(username, 0) + 1
+        if timestamp[:7] not in archived:  # already counted in the archived statement
+            by_user[username].append((trans_type, amount, fee, timestamp))
+    stored_totals = {u: {"balance": b, "fees": f, "txn_count": c} for u, b, f, c in balances}
+    stored_months = {}
+    for username, month, opening, closing, deposits, withdrawals, fees, count in statements:
+        stored_months.setdefault(username, {})[month] = {
+            "opening_balance": opening, "closing_balance": closing, "deposits": deposits,
+            "withdrawals": withdrawals, "fees": fees, "txn_count": count}
+    account_totals = {}
+    named_totals = {}  # the accounts users can see; the ones the ledger names
+    negatives = {}
+    for username, name, balance in accounts:
+        total, count = account_totals.get(username, (0.0, 0))
+        account_totals[username] = (total + (balance or 0.0), count + 1)
+        if name is not None:
+            named_totals[username] = named_totals.get(username, 0.0) + (balance or 0.0)
+        if (balance or 0.0) < -TOLERANCE:
+            negatives.setdefault(username, []).append({"username": username, "kind": "negative_balance",
+                                                       "account": name, "actual": balance})
+
+    now = datetime.datetime.now().isoformat()
+    found, state = [], []
+    for username in usernames:
+        # Archived months are closed: the replay starts from their statements
+        stored = stored_months.get(username, {})
+        closed = [(m, stored[m]) for m in sorted(stored) if m in archived]
+        balance = fees = 0.0
+        count = 0
+        user_found = []
+        for month, stmt in closed:
+            net = stmt["closing_balance"] - stmt["opening_balance"]
+            if _differs(balance, stmt["opening_balance"]):
+                user_found.append({"username": username, "kind": "statement", "month": month,
+                                   "expected": dict(stmt, opening_balance=balance,
+                                                    closing_balance=balance + net),
+                                   "actual": stmt})
+            balance += net
+            fees += stmt["fees"]
+            count += stmt["txn_count"]
+        totals, months = replay(by_user[username], balance, fees, count)
+        user_found += _compare(username, totals, months, stored_totals.get(username),
+                               {m: v for m, v in stored.items() if m not in archived})
+        if (username in named_totals or totals["txn_count"]) \
+                and _differs(totals["balance"], named_totals.get(username, 0.0)):
+            user_found.append({"username": username, "kind": "account_balance",
+                               "expected": totals["balance"],
+                               "actual": named_totals.get(username, 0.0)})
+        user_found += negatives.get(username, [])
+        total, count = account_totals.get(username, (0.0, 0))
+        state.append((username, max_ids.get(username, 0), hot_counts.get(username, 0), total, count, now,
+                      int(not user_found)))
+        found += user_found
+    return found, state
+
+
+def _fingerprints(pool):
+    """{username: (max_id, txn_count, accounts_total, account_count)} from live data"""
+    prints = {}
+    with pool.connection() as conn:
+        for username, max_id, count in conn.execute("""SELECT username, MAX(id), COUNT(*)
+                                                       FROM transactions GROUP BY username"""):
+            prints[username] = [max_id, count, 0.0, 0]
+        for username, total, count in conn.execute("""SELECT username, TOTAL(balance), COUNT(*)
+                                                      FROM accounts GROUP BY username"""):
+            prints.setdefault(username, [0, 0, 0.0, 0])[2:] = [total, count]
+    return prints
+
+
+def changed_users(pool, full=False):
+    """Users whose data changed since their last clean verification"""
+    prints = _fingerprints(pool)
+    if full:
+        return sorted(prints)
+    with pool.connection() as conn:
+        state = {row[0]: row[1:] for row in conn.execute(
+            "SELECT username, max_id, txn_count, accounts_total, account_count, ok FROM reconcile_state")}
+    changed = []
+    for username, (max_id, count, total, accounts) in prints.items():
+        seen = state.get(username)
+        if (seen is None or not seen[4] or seen[0] != max_id or seen[1] != count
+                or seen[3] != accounts or abs((seen[2] or 0.0) - total) > TOLERANCE):
+            changed.append(username)
+    return sorted(changed)
+
+
+def check_json_files(directory):
+    """Legacy accounts_<user>.json balances that disagree with the accounts table"""
+    found = []
+    for path in sorted(glob.glob(os.path.join(directory, "accounts_*.json"))):
+        username = os.path.basename(path)[len("accounts_"):-len(".json")]
+        with open(path) as f:
+            stored = json.load(f)
+        with db.connection(username) as conn:
+            table = dict(conn.execute("SELECT name, balance FROM accounts WHERE username=?",
+                                      (username,)).fetchall())
+        for name, data in stored.items():
+            if name in table and _differs(data.get("balance", 0.0), table[name]):
+                found.append({"username": username, "kind": "json_stale", "account": name,
+                              "expected": table[name], "actual": data.get("balance"),
+                              "file": path})
+    return found
+
+
+def _save_state(pool, rows):
+    with pool.transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO reconcile_state VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def run(workers=None, chunk_size=CHUNK_SIZE, full=False, json_dir=None):
+    """Verify changed (or all) users; returns (discrepancies, stats)"""
+    started = time.perf_counter()
+    pools = [(i, db.shard_pool(i)) for i in range(db.shard_count())] or [(-1, db.get_pool())]
+    tasks = []
+    for shard, pool in pools:
+        users = changed_users(pool, full)
+        tasks += [(shard, users[i:i + chunk_size]) for i in range(0, len(users), chunk_size)]
+
+    found = []
+    checked = 0
+    # spawn, so workers open their own SQLite handles
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=db.configure,
+                             initargs=(db.get_pool().path, db.POOL_SIZE, db.shard_count())) as executor:
+        futures = {executor.submit(verify_chunk, shard, users): shard for shard, users in tasks}
+        for future, shard in futures.items():
+            chunk_found, state = future.result()
+            # Checkpoint as chunks finish, so an interrupted audit resumes
+            _save_state(db.get_pool() if shard < 0 else db.shard_pool(shard), state)
+            found += chunk_found
+            checked += len(state)
+    if json_dir:
+        found += check_json_files(json_dir)
+    stats = {"users_checked": checked, "chunks": len(tasks), "discrepancies": len(found),
+             "seconds": time.perf_counter() - started}
+    return found, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile the ledger against stored balances")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--full", action="store_true", help="ignore the checkpoint, verify everyone")
+    parser.add_argument("--report", help="write discrepancies to this JSONL file")
+    parser.add_argument("--json-dir", help="also compare legacy accounts_<user>.json files here")
+    args = parser.parse_args(argv)
+
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    found, stats = run(args.workers, args.chunk_size, args.full, args.json_dir)
+
+    kinds = {}
+    for d in found:
+        kinds[d["kind"]] = kinds.get(d["kind"], 0) + 1
+    print(f"Checked {stats['users_checked']} user(s) in {stats['seconds']:.2f}s: "
+          f"{stats['discrepancies']} discrepancy(ies) {kinds or ''}".rstrip())
+    if args.report:
+        with open(args.report, "w") as f:
+            f.writelines(json.dumps(d) + "\n" for d in found)
+    else:
+        for d in found[:20]:
+            print(json.dumps(d))
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
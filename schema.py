@@ -0,0 +1,165 @@
+"""Versioned schema migrations for bank.db.
+
+The database's PRAGMA user_version records how many entries of MIGRATIONS
+have been applied. ensure() brings the configured databases (the
+directory and any shards) up to date the first time it is called in a
+process and is a set lookup after that, so entry points call it freely
+instead of running DDL on import. Every file gets the full schema, which
+keeps the migrations simple; tables a file doesn't use stay empty.
+
+To change the schema, append a function to MIGRATIONS; never edit or
+reorder the ones already shipped.
+"""
+import threading
+
+import db
+
+_done = set()  # database paths already migrated in this process
+_lock = threading.Lock()
+
+
+def _base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users
+                    (username TEXT PRIMARY KEY,
+                     password TEXT,
+                     full_name TEXT,
+                     email TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS accounts
+                    (account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     username TEXT,
+                     account_type TEXT,
+                     balance REAL DEFAULT 0.0,
+                     FOREIGN KEY(username) REFERENCES users(username))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS premium_members
+                    (username TEXT PRIMARY KEY,
+                     since_date TEXT,
+                     expiry_date TEXT,
+                     FOREIGN KEY(username) REFERENCES users(username))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS transactions
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     username TEXT,
+                     type TEXT,
+                     amount REAL,
+                     fee REAL,
+                     timestamp TEXT,
+                     FOREIGN KEY(username) REFERENCES users(username))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS partner_usage
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     username TEXT,
+                     partner_name TEXT,
+                     used INTEGER DEFAULT 0,
+                     FOREIGN KEY(username) REFERENCES users(username))''')
+
+
+def _accounts(conn):
+    import account_store
+    account_store.ensure_schema(conn)
+
+
+def _history(conn):
+    import history
+    history.ensure_schema(conn)
+
+
+def _membership(conn):
+    import membership
+    membership.ensure_schema(conn)
+
+
+def _snapshots(conn):
+    import snapshots
+    snapshots.ensure_schema(conn)
+
+
+def _payments(conn):
+    import payments
+    payments.ensure_schema(conn)
+
+
+def _partner_usage(conn):
+    import partner_offers
+    partner_offers.ensure_schema(conn)
+
+
+def _reconcile(conn):
+    import reconcile
+    reconcile.ensure_schema(conn)
+
+
+def _archive(conn):
+    import archive
+    archive.ensure_schema(conn)
+
+
+def _premium_charges(conn):
+    # One row per member and month charged by interest_batch --charge-premium
+    conn.execute("""CREATE TABLE IF NOT EXISTS premium_charges
+                    (username TEXT NOT NULL,
+                     month TEXT NOT NULL,
+                     account_id INTEGER,
+                     amount REAL,
+                     charged_at TEXT,
+                     PRIMARY KEY (username, month))""")
+
+
+def _opening_balances(conn):
+    import account_store
+    account_store.backfill_opening_balances(conn)
+
+
+def _user_shards(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_shards
+                    (username TEXT PRIMARY KEY,
+                     shard INTEGER NOT NULL)""")
+
+
+# Databases created before versioning already have some of these; every
+# step is idempotent so they upgrade cleanly from user_version 0.
+MIGRATIONS = [
+    _base_tables,
+    _accounts,
+    _history,
+    _membership,
+    _snapshots,
+    _user_shards,
+    _payments,
+    _partner_usage,
+    _reconcile,
+    _archive,
+    _premium_charges,
+    _opening_balances,
+]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(pool=None):
+    """Apply pending migrations to one pool's database; returns the count"""
+    pool = pool or db.get_pool()
+    with pool.transaction(immediate=True) as conn:
+        version = current_version(conn)
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        if version < len(MIGRATIONS):
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    return max(0, len(MIGRATIONS) - version)
+
+
+def ensure():
+    """Migrate every configured database once per process"""
+    pools = db.all_pools()
+    if all(pool.path in _done for pool in pools):
+        return
+    with _lock:
+        for pool in pools:
+            if pool.path not in _done:
+                migrate(pool)
+                _done.add(pool.path)
+
+
+if __name__ == "__main__":
+    for pool in db.all_pools():
+        print(f"{pool.path}: applied {migrate(pool)} migration(s); "
+              f"schema version {len(MIGRATIONS)}")
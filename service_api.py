@@ -0,0 +1,301 @@
+"""Headless async API over the banking core (plain ASGI, no framework).
+
+    python service_api.py --port 8000      # needs uvicorn installed
+
+    POST /signup    {"username", "password", "full_name", "email"}
+    POST /login     {"username", "password"}            -> {"token"}
+    GET  /accounts
+    POST /accounts  {"name", "type", "balance"}
+    POST /deposit   {"account", "amount"}
+    POST /withdraw  {"account", "amount"}
+    POST /transfer  {"from", "to", "amount"}
+    POST /payments  {"amount", "idempotency_key"}     -> applied / duplicate
+    GET  /history   ?cursor=...&limit=20
+    GET  /statements                                   -> ledger totals + monthly activity
+    POST /upgrade   {"auto_renew": false}
+    GET  /metrics                                      -> Prometheus text format
+
+Everything except /signup, /login and /metrics needs "Authorization: Bearer <token>".
+Withdrawals and transfers over a velocity limit (velocity.py) get 429.
+Blocking SQLite and KDF work runs on a bounded thread pool, so the event
+loop keeps accepting requests while earlier ones wait on the database.
+"""
+import argparse
+import asyncio
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import account_store
+import auth
+import history
+import instrumentation
+import ledger
+import membership
+import payments
+import schema
+import snapshots
+import transfers
+import velocity
+from account_models import ACCOUNT_TYPES, BalanceException, VelocityError
+
+DB_WORKERS = 8
+MAX_BODY_BYTES = 64 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="api-db")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _run(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+def _field(body, name, kind=str):
+    value = body.get(name)
+    if value is None:
+        raise HTTPError(400, f"Missing field: {name}")
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Invalid value for {name}")
+
+
+def _amount(body):
+    amount = _field(body, "amount", float)
+    if not (amount > 0 and math.isfinite(amount)):
+        raise HTTPError(400, "amount must be a positive number")
+    return amount
+
+
+async def signup(user, body, query):
+    created = await _run(auth.create_user, _field(body, "username"), _field(body, "password"),
+                         body.get("full_name", ""), body.get("email", ""))
+    if not created:
+        raise HTTPError(409, "Username already exists")
+    return 201, {"created": True}
+
+
+async def login(user, body, query):
+    token = await _run(auth.login, _field(body, "username"), _field(body, "password"))
+    if token is None:
+        raise HTTPError(401, "Invalid username or password")
+    return 200, {"token": token}
+
+
+async def list_accounts(user, body, query):
+    return 200, await _run(account_store.load_accounts, user)
+
+
+async def open_account(user, body, query):
+    account_type = body.get("type", "BankAccount")
+    if account_type not in ACCOUNT_TYPES:
+        raise HTTPError(400, f"Unknown account type: {account_type}")
+    balance = _field(body, "balance", float) if "balance" in body else 0.0
+    if not (balance >= 0 and math.isfinite(balance)):
+        raise HTTPError(400, "balance must be a non-negative number")
+    created = await _run(account_store.create_account, user, _field(body, "name"),
+                         account_type, balance)
+    if not created:
+        raise HTTPError(409, "Account with this name already exists.")
+    return 201, {"name": body["name"], "type": account_type, "balance": balance}
+
+
+async def _account_operation(user, body, operation):
+    name = _field(body, "account")
+    balance = await _run(account_store.apply_operation, user, name, operation, _amount(body))
+    if balance is None:
+        raise HTTPError(404, f"No account named {name}")
+    return 200, {"account": name, "balance": balance}
+
+
+async def deposit(user, body, query):
+    return await _account_operation(user, body, "deposit")
+
+
+async def withdraw(user, body, query):
+    return await _account_operation(user, body, "withdraw")
+
+
+async def transfer(user, body, query):
+    premium = await _run(membership.is_premium_user, user)
+    balances = await _run(transfers.transfer, user, _field(body, "from"), _field(body, "to"),
+                          _amount(body), premium)
+    return 200, {"balances": balances}
+
+
+async def add_payment(user, body, query):
+    # One payment per request: apply it directly on the DB pool. The batching
+    # queue is for provider bursts; its bounded put() would block the loop.
+    status = await _run(payments.ingest, user, _amount(body), _field(body, "idempotency_key"),
+                        "api")
+    if status == payments.NO_ACCOUNT:
+        raise HTTPError(404, "Open an account before adding funds")
+    return 200, {"status": status}
+
+
+async def get_history(user, body, query):
+    try:
+        limit = int(query.get("limit", history.PAGE_SIZE))
+    except ValueError:
+        raise HTTPError(400, "Invalid value for limit")
+    if limit < 1:
+        raise HTTPError(400, "limit must be at least 1")
+    limit = min(limit, 500)
+    rows, cursor = await _run(history.fetch_page, user, query.get("cursor"), limit)
+    return 200, {"transactions": rows, "next_cursor": cursor}
+
+
+async def get_statements(user, body, query):
+    # Ledger flow and monthly activity; account balances come from /accounts
+    totals = await _run(snapshots.get_balance, user)
+    statements = await _run(snapshots.list_statements, user)
+    return 200, {"ledger": totals, "statements": statements}
+
+
+async def upgrade(user, body, query):
+    if not await _run(membership.upgrade_to_premium, user, bool(body.get("auto_renew"))):
+        raise HTTPError(500, "Upgrade failed. Please try again.")
+    return 200, {"premium": True, "expiry_date": membership.get_premium_expiry(user)}
+
+
+async def metrics(user, body, query):
+    return 200, instrumentation.prometheus_text()
+
+
+# (method, path) -> (handler, needs_auth)
+ROUTES = {
+    ("POST", "/signup"): (signup, False),
+    ("POST", "/login"): (login, False),
+    ("GET", "/accounts"): (list_accounts, True),
+    ("POST", "/accounts"): (open_account, True),
+    ("POST", "/deposit"): (deposit, True),
+    ("POST", "/withdraw"): (withdraw, True),
+    ("POST", "/transfer"): (transfer, True),
+    ("POST", "/payments"): (add_payment, True),
+    ("GET", "/history"): (get_history, True),
+    ("GET", "/statements"): (get_statements, True),
+    ("POST", "/upgrade"): (upgrade, True),
+    ("GET", "/metrics"): (metrics, False),
+}
+
+
+def _reject_constant(name):
+    # json.loads accepts bare NaN/Infinity; no field here may hold them
+    raise ValueError(f"{name} is not allowed")
+
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    raw = b"".join(chunks)
+    if not raw:
+        return {}
+    try:
+        body = json.loads(raw, parse_constant=_reject_constant)
+    except ValueError:
+        raise HTTPError(400, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    return body
+
+
+def _bearer_token(scope):
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                return token.strip()
+    return None
+
+
+async def _send(send, status, payload):
+    if isinstance(payload, str):
+        data, content_type = payload.encode(), b"text/plain; version=0.0.4"
+    else:
+        data, content_type = json.dumps(payload).encode(), b"application/json"
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type),
+                            (b"content-length", str(len(data)).encode())]})
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await _run(schema.ensure)
+            await _run(velocity.ensure_rebuilt)
+            membership.start_sweeper()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await _run(payments.shutdown)
+            await _run(ledger.flush)
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    try:
+        route = ROUTES.get((scope["method"], scope["path"]))
+        if route is None:
+            raise HTTPError(404, "Not found")
+        handler, needs_auth = route
+        user = None
+        if needs_auth:
+            user = auth.session_user(_bearer_token(scope))
+            if user is None:
+                raise HTTPError(401, "Missing or expired token")
+        body = await _read_body(receive)
+        query = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        with instrumentation.timer(f"api {scope['method']} {scope['path']}"):
+            status, payload = await handler(user, body, query)
+    except HTTPError as e:
+        status, payload = e.status, {"error": e.message}
+    except VelocityError as e:
+        status, payload = 429, {"error": str(e)}
+    except BalanceException as e:
+        status, payload = 400, {"error": str(e).strip()}
+    except ValueError as e:
+        status, payload = 400, {"error": str(e)}
+    except Exception as e:
+        status, payload = 500, {"error": f"Internal error: {e}"}
+    await _send(send, status, payload)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the banking API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("service_api needs an ASGI server: pip install uvicorn")
+
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Cached reads for the Streamlit views.
+
+Each user has a version number that is part of every cache key. Reruns
+that don't change anything hit st.cache_data and skip the database; any
+mutation calls invalidate(username), which bumps that user's version so
+only their entries are re-read.
+"""
+import threading
+
+import streamlit as st
+
+import account_store
+import history
+import snapshots
+
+CACHE_ENTRIES = 2048
+CACHE_TTL = 600  # seconds; stale versions age out of st.cache_data
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def version(username):
+    return _versions.get(username, 0)
+
+
+def invalidate(username):
+    """Drop every cached view of this user's data"""
+    with _versions_lock:
+        _versions[username] = _versions.get(username, 0) + 1
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def _accounts(username, version):
+    return account_store.load_accounts(username)
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def _history_summary(username, version):
+    return history.summary(username)
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def _history_page(username, version, cursor):
+    return history.fetch_page(username, cursor)
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def _ledger_balance(username, version):
+    return snapshots.get_balance(username)
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, show_spinner=False)
+def _statement(username, version, month):
+    return snapshots.get_statement(username, month)
+
+
+def load_accounts(username):
+    return _accounts(username, version(username))
+
+
+def history_summary(username):
+    return _history_summary(username, version(username))
+
+
+def history_page(username, cursor=None):
+    return _history_page(username, version(username), cursor)
+
+
+def ledger_balance(username):
+    return _ledger_balance(username, version(username))
+
+
+def statement(username, month=None):
+    return _statement(username, version(username), month)
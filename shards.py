@@ -0,0 +1,235 @@
+"""Shard maintenance and cross-shard queries.
+
+    python shards.py --shards 4 status            # users and rows per shard
+    python shards.py --shards 4 split             # move bank.db's user data onto the shards
+    python shards.py --shards 4 move alice 2      # move one user to shard 2
+    python shards.py --shards 4 rebalance         # even out users per shard
+
+A move copies the user's accounts, transactions, partner usage,
+payments and premium charges to the target shard (the snapshot trigger
+rebuilds their balances and statements there), points the directory at
+the target, then deletes the old copy. Archived months stay in the
+shared archive files; their statements move with the user.
+The source stays write-locked for the whole move, so nothing is lost in
+this process; other processes cache placements for db.PLACEMENT_CACHE_TTL
+seconds, so run moves while the app is stopped or restart workers after.
+
+query_all() and aggregate() fan a read out to every shard in parallel and
+merge the results, e.g. bank-wide totals:
+
+    aggregate("SELECT COUNT(*), TOTAL(fee), MAX(timestamp) FROM transactions",
+              combine=("sum", "sum", "max"))
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import archive
+import db
+import ledger
+import schema
+
+# Per-user tables that move with the user; ledger_balances and statements
+# are rebuilt by the snapshot trigger as the transactions are copied, and a
+# moved user is simply re-verified by the next reconcile run.
+USER_TABLES = ("accounts", "transactions", "partner_usage", "payments", "premium_charges")
+DERIVED_TABLES = ("ledger_balances", "statements", "reconcile_state")
+QUERY_WORKERS = 8
+
+_COMBINE = {
+    "sum": lambda values: sum(v for v in values if v is not None),
+    "min": lambda values: min((v for v in values if v is not None), default=None),
+    "max": lambda values: max((v for v in values if v is not None), default=None),
+}
+
+_executor = None
+
+
+def _pool_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="shard-query")
+    return _executor
+
+
+def _fetch(pool, sql, params):
+    with pool.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def query_all(sql, params=()):
+    """Run a read on every shard in parallel; returns one row list per shard"""
+    pools = db.data_pools()
+    if len(pools) == 1:
+        return [_fetch(pools[0], sql, params)]
+    return list(_pool_executor().map(lambda pool: _fetch(pool, sql, params), pools))
+
+
+def aggregate(sql, params=(), combine=None, group_by=0):
+    """Merge a SUM/MIN/MAX/COUNT query across shards
+
+    combine names how each non-key column merges ("sum", "min" or "max";
+    COUNT merges with "sum"). Averages don't merge: select SUM and COUNT
+    and divide. With group_by=k the first k columns are the group key and
+    a {key: [values]} dict is returned; otherwise one merged row.
+    """
+    per_shard = query_all(sql, params)
+    groups = {}
+    for rows in per_shard:
+        for row in rows:
+            groups.setdefault(tuple(row[:group_by]), []).append(row[group_by:])
+    merged = {}
+    for key, rows in groups.items():
+        columns = list(zip(*rows))
+        how = combine or ("sum",) * len(columns)
+        merged[key[0] if group_by == 1 else key] = [_COMBINE[h](col) for h, col in zip(how, columns)]
+    if group_by:
+        return merged
+    return merged.get((), [None] * len(combine or ()))
+
+
+def _columns(conn, table):
+    """Column names to copy, leaving out the INTEGER PRIMARY KEY"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+            if not (row[5] and row[2].upper() == "INTEGER")]
+
+
+def _delete_user(conn, username):
+    for table in USER_TABLES + DERIVED_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE username=?", (username,))
+
+
+def _copy_user(source, target, username):
+    # Leftovers of an interrupted move are orphans: the directory never
+    # pointed at them
+    _delete_user(target, username)
+    # Archived months' statements first, so the trigger continues from them
+    archive.carry_over(source, target, username)
+    moved = {}
+    for table in USER_TABLES:
+        columns = ", ".join(_columns(source, table))
+        order = "timestamp, id" if table == "transactions" else "rowid"
+        rows = source.execute(f"SELECT {columns} FROM {table} WHERE username=? ORDER BY {order}",
+                              (username,)).fetchall()
+        if rows:
+            marks = ", ".join("?" * len(rows[0]))
+            target.executemany(f"INSERT INTO {table} ({columns}) VALUES ({marks})", rows)
+        moved[table] = len(rows)
+    return moved
+
+
+def move_user(username, target, source=None):
+    """Move one user's rows to shard target; returns rows moved per table"""
+    source = source or db.pool_for(username)
+    dest = db.shard_pool(target)
+    if source is dest:
+        return {}
+    ledger.flush()  # queued rows must land before the copy
+    with source.transaction(immediate=True) as src:
+        with dest.transaction(immediate=True) as dst:
+            moved = _copy_user(src, dst, username)
+        # The copy is committed; repoint the directory, then drop the original
+        with db.transaction() as conn:
+            db.set_shard(conn, username, target)
+        _delete_user(src, username)
+    return moved
+
+
+def split():
+    """Move every user's data out of the directory database onto its shard"""
+    directory = db.get_pool()
+    with directory.connection() as conn:
+        users = [row[0] for row in conn.execute("SELECT username FROM users")]
+        with_data = {row[0] for row in conn.execute("""SELECT username FROM accounts
+                                                       UNION SELECT username FROM transactions""")}
+    moved = 0
+    for username in sorted(with_data | set(users)):
+        target = db.shard_of(username)
+        if username in with_data:
+            move_user(username, target, source=directory)
+            moved += 1
+        else:
+            with db.transaction() as conn:
+                db.set_shard(conn, username, target)
+    return moved
+
+
+def placements():
+    """{shard: [usernames]} for every user in the directory"""
+    with db.connection() as conn:
+        users = [row[0] for row in conn.execute("SELECT username FROM users ORDER BY username")]
+    placed = {i: [] for i in range(db.shard_count())}
+    for username in users:
+        placed[db.shard_of(username)].append(username)
+    return placed
+
+
+def rebalance(max_moves=None):
+    """Move users from the fullest to the emptiest shard until counts are within one
+
+    The users with the fewest ledger rows move first, since they are the
+    cheapest to copy. Returns the list of (username, from, to) moves.
+    """
+    placed = placements()
+    rows_per_user = {}
+    for rows in query_all("SELECT username, COUNT(*) FROM transactions GROUP BY username"):
+        rows_per_user.update(rows)
+    for users in placed.values():
+        users.sort(key=lambda u: rows_per_user.get(u, 0), reverse=True)
+
+    moves = []
+    while max_moves is None or len(moves) < max_moves:
+        fullest = max(placed, key=lambda i: len(placed[i]))
+        emptiest = min(placed, key=lambda i: len(placed[i]))
+        if len(placed[fullest]) - len(placed[emptiest]) <= 1:
+            break
+        username = placed[fullest].pop()
+        move_user(username, emptiest)
+        placed[emptiest].append(username)
+        moves.append((username, fullest, emptiest))
+    return moves
+
+
+def status():
+    counts = query_all("""SELECT (SELECT COUNT(*) FROM accounts),
+                                 (SELECT COUNT(*) FROM transactions)""")
+    placed = placements()
+    return [{"shard": i, "path": db.shard_pool(i).path, "users": len(placed[i]),
+             "accounts": counts[i][0][0], "transactions": counts[i][0][1]}
+            for i in range(db.shard_count())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shard maintenance")
+    parser.add_argument("--db", default=db.DB_PATH, help="directory database (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS, help="number of shard files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="users and rows per shard")
+    sub.add_parser("split", help="move user data from the directory database onto the shards")
+    move = sub.add_parser("move", help="move one user to another shard")
+    move.add_argument("username")
+    move.add_argument("target", type=int)
+    reb = sub.add_parser("rebalance", help="even out the number of users per shard")
+    reb.add_argument("--max-moves", type=int)
+    args = parser.parse_args(argv)
+
+    if args.shards < 1:
+        parser.error("--shards (or BANK_SHARDS) must be at least 1")
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+
+    if args.command == "split":
+        print(f"Moved {split()} user(s) onto {args.shards} shard(s)")
+    elif args.command == "move":
+        if not 0 <= args.target < args.shards:
+            parser.error(f"target must be between 0 and {args.shards - 1}")
+        print(move_user(args.username, args.target))
+    elif args.command == "rebalance":
+        for username, source, target in rebalance(args.max_moves):
+            print(f"{username}: shard {source} -> {target}")
+    for row in status():
+        print(f"shard {row['shard']} ({row['path']}): {row['users']} users, "
+              f"{row['accounts']} accounts, {row['transactions']} transactions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Precomputed per-user ledger balances and monthly statements.
+
+A trigger on `transactions` keeps two tables current on every insert, no
+matter which path wrote the row (record_transaction, transfers, bulk
+import, the interest batch):
+
+    ledger_balances  one row per user: running ledger balance, fees, count
+    statements       one row per user per month (YYYY-MM): opening and
+                     closing balance, deposits, withdrawals, fees, count
+
+Readers get O(1) primary-key lookups instead of replaying the ledger.
+Deposits and interest add to the balance, withdrawals subtract, and every
+row's fee is subtracted; "Transfer to" rows move money between the user's
+own accounts, so only their fee counts.
+
+These "balances" are what the user's ledger rows add up to (the figure
+reconcile.py checks), not what their accounts hold: opening balances,
+the bonus InterestRewardAcct/SavingsAcct add on deposits and a
+transfer's credited_amount never become ledger rows. Account balances
+live in `accounts`. So the readers below report net ledger flow and
+monthly activity, not opening/closing balances. rebuild() recomputes everything,
+e.g. after importing historical rows out of time order; statements for
+months moved to archive files (archive.py) are kept as they are.
+"""
+import datetime
+import json
+
+import db
+
+DELTA_SQL = """(CASE
+    WHEN lower({row}.type) LIKE 'deposit%' OR lower({row}.type) LIKE 'interest%' THEN {row}.amount
+    WHEN lower({row}.type) LIKE 'withdraw%' THEN -{row}.amount
+    ELSE 0 END - COALESCE({row}.fee, 0))"""
+CREDIT_SQL = """(CASE WHEN lower({row}.type) LIKE 'deposit%' OR lower({row}.type) LIKE 'interest%'
+    THEN {row}.amount ELSE 0 END)"""
+DEBIT_SQL = """(CASE WHEN lower({row}.type) LIKE 'withdraw%' THEN {row}.amount ELSE 0 END)"""
+
+
+def _trigger_sql():
+    delta = DELTA_SQL.format(row="NEW")
+    credit = CREDIT_SQL.format(row="NEW")
+    debit = DEBIT_SQL.format(row="NEW")
+    return f"""CREATE TRIGGER IF NOT EXISTS trg_transactions_snapshots
+        AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO ledger_balances (username, balance, fees, txn_count, updated_at)
+            VALUES (NEW.username, {delta}, COALESCE(NEW.fee, 0), 1, NEW.timestamp)
+            ON CONFLICT(username) DO UPDATE SET
+                balance = balance + excluded.balance,
+                fees = fees + excluded.fees,
+                txn_count = txn_count + 1,
+                updated_at = max(updated_at, excluded.updated_at);
+
+            INSERT INTO statements (username, month, opening_balance, closing_balance,
+                                    deposits, withdrawals, fees, txn_count)
+            VALUES (NEW.username, substr(NEW.timestamp, 1, 7),
+                    (SELECT balance FROM ledger_balances WHERE username = NEW.username) - {delta},
+                    (SELECT balance FROM ledger_balances WHERE username = NEW.username),
+                    {credit}, {debit}, COALESCE(NEW.fee, 0), 1)
+            ON CONFLICT(username, month) DO UPDATE SET
+                closing_balance = closing_balance + {delta},
+                deposits = deposits + excluded.deposits,
+                withdrawals = withdrawals + excluded.withdrawals,
+                fees = fees + excluded.fees,
+                txn_count = txn_count + 1;
+        END"""
+
+
+def ensure_schema(conn):
+    created = conn.execute("""SELECT COUNT(*) FROM sqlite_master
+                              WHERE type='table' AND name='ledger_balances'""").fetchone()[0] == 0
+    conn.execute("""CREATE TABLE IF NOT EXISTS ledger_balances
+                    (username TEXT PRIMARY KEY,
+                     balance REAL DEFAULT 0.0,
+                     fees REAL DEFAULT 0.0,
+                     txn_count INTEGER DEFAULT 0,
+                     updated_at TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS statements
+                    (username TEXT,
+                     month TEXT,
+                     opening_balance REAL,
+                     closing_balance REAL,
+                     deposits REAL DEFAULT 0.0,
+                     withdrawals REAL DEFAULT 0.0,
+                     fees REAL DEFAULT 0.0,
+                     txn_count INTEGER DEFAULT 0,
+                     PRIMARY KEY (username, month))""")
+    conn.execute(_trigger_sql())
+    if created:
+        # Existing ledger rows predate the trigger
+        _rebuild(conn)
+
+
+def _rebuild(conn, archived=()):
+    """Recompute from `transactions`; archived months' statements are kept
+    and the open months continue from their closing balance"""
+    months = json.dumps(sorted(archived))
+    delta = DELTA_SQL.format(row="t")
+    credit = CREDIT_SQL.format(row="t")
+    debit = DEBIT_SQL.format(row="t")
+    conn.execute("DELETE FROM ledger_balances")
+    conn.execute("DELETE FROM statements WHERE month NOT IN (SELECT value FROM json_each(?))",
+                 (months,))
+    # Back-dated rows only touched their own month: re-chain the archived
+    # months' opening/closing balances from each month's net
+    conn.execute("""WITH chain AS (
+                        SELECT username, month, closing_balance - opening_balance AS net,
+                               SUM(closing_balance - opening_balance) OVER (
+                                   PARTITION BY username ORDER BY month) AS running
+                        FROM statements)
+                    UPDATE statements SET opening_balance = chain.running - chain.net,
+                                          closing_balance = chain.running
+                    FROM chain
+                    WHERE chain.username = statements.username AND chain.month = statements.month""")
+    conn.execute(f"""INSERT INTO statements (username, month, opening_balance, closing_balance,
+                                             deposits, withdrawals, fees, txn_count)
+                     WITH monthly AS (
+                         SELECT t.username, substr(t.timestamp, 1, 7) AS month,
+                                SUM({delta}) AS net, SUM({credit}) AS deposits,
+                                SUM({debit}) AS withdrawals, TOTAL(t.fee) AS fees,
+                                COUNT(*) AS txn_count
+                         FROM transactions t
+                         WHERE substr(t.timestamp, 1, 7) NOT IN (SELECT value FROM json_each(?))
+                         GROUP BY t.username, month),
+                     carried AS (
+                         SELECT username, closing_balance AS balance FROM statements s
+                         WHERE month = (SELECT MAX(month) FROM statements WHERE username = s.username))
+                     SELECT m.username, m.month,
+                            COALESCE(c.balance, 0) + SUM(net) OVER w - net,
+                            COALESCE(c.balance, 0) + SUM(net) OVER w,
+                            deposits, withdrawals, fees, txn_count
+                     FROM monthly m LEFT JOIN carried c ON c.username = m.username
+                     WINDOW w AS (PARTITION BY m.username ORDER BY m.month)""", (months,))
+    conn.execute("""INSERT INTO ledger_balances (username, balance, fees, txn_count, updated_at)
+                    SELECT s.username, s.closing_balance, totals.fees, totals.txn_count,
+                           COALESCE(latest.timestamp, s.month)
+                    FROM statements s
+                    JOIN (SELECT username, MAX(month) AS month, TOTAL(fees) AS fees,
+                                 SUM(txn_count) AS txn_count
+                          FROM statements GROUP BY username) totals
+                      ON totals.username = s.username AND totals.month = s.month
+                    LEFT JOIN (SELECT username, MAX(timestamp) AS timestamp
+                               FROM transactions GROUP BY username) latest
+                      ON latest.username = s.username""")
+
+
+def rebuild():
+    """Recompute every balance and statement from the ledger"""
+    import archive
+    archived = archive.archived_months()
+    for pool in db.data_pools():
+        with pool.transaction(immediate=True) as conn:
+            _rebuild(conn, archived)
+
+
+def get_balance(username):
+    """Ledger totals for one user (net flow, fees, count), or None"""
+    with db.connection(username) as conn:
+        row = conn.execute("""SELECT balance, fees, txn_count, updated_at FROM ledger_balances
+                              WHERE username = ?""", (username,)).fetchone()
+    if row is None:
+        return None
+    return {"net_flow": row[0], "fees": row[1], "txn_count": row[2], "updated_at": row[3]}
+
+
+def get_statement(username, month=None):
+    """Ledger activity for a YYYY-MM month (default: current month), or None
+
+    net is the month's ledger flow (closing - opening), not a change in
+    the accounts' balances.
+    """
+    month = month or datetime.date.today().strftime("%Y-%m")
+    with db.connection(username) as conn:
+        row = conn.execute("""SELECT closing_balance - opening_balance, deposits, withdrawals,
+                                     fees, txn_count
+                              FROM statements WHERE username = ? AND month = ?""",
+                           (username, month)).fetchone()
+    if row is None:
+        return None
+    keys = ("net", "deposits", "withdrawals", "fees", "txn_count")
+    return dict(zip(keys, row), month=month)
+
+
+def list_statements(username, limit=12):
+    """Most recent months of ledger activity (as get_statement), newest first"""
+    with db.connection(username) as conn:
+        rows = conn.execute("""SELECT month, closing_balance - opening_balance, deposits,
+                                      withdrawals, fees, txn_count
+                               FROM statements WHERE username = ?
+                               ORDER BY month DESC LIMIT ?""", (username, limit)).fetchall()
+    keys = ("month", "net", "deposits", "withdrawals", "fees", "txn_count")
+    return [dict(zip(keys, row)) for row in rows]
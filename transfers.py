@@ -0,0 +1,85 @@
+"""Atomic transfers between two of a user's accounts.
+
+The debit, credit, fees and ledger rows are all written inside one
+BEGIN IMMEDIATE transaction, so a failure part-way leaves nothing behind
+and two concurrent transfers can't both spend the same balance. Velocity
+limits (velocity.py) are reserved once the source account's type is known
+and released again if the transaction doesn't commit.
+"""
+import datetime
+import math
+import random
+import sqlite3
+import time
+
+import db
+import instrumentation
+import velocity
+from account_models import BalanceException, credited_amount, transfer_fee, withdraw_fee
+
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.02  # seconds, doubled on each retry
+
+
+class TransferError(BalanceException):
+    pass
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _apply(conn, username, from_name, to_name, amount, premium):
+    rows = conn.execute("""SELECT name, account_type, balance FROM accounts
+                           WHERE username=? AND name IN (?, ?)""",
+                        (username, from_name, to_name)).fetchall()
+    found = {name: (acc_type, balance) for name, acc_type, balance in rows}
+    if from_name not in found or to_name not in found:
+        raise TransferError("Unknown account")
+
+    from_type, from_balance = found[from_name]
+    to_type, to_balance = found[to_name]
+    velocity.reserve(username, from_name, from_type, amount, premium)
+    w_fee = withdraw_fee(from_type, amount, premium)
+    t_fee = transfer_fee(amount, premium)
+    debit = amount + w_fee + t_fee
+    if from_balance < debit:
+        raise TransferError(f"Not enough funds in '{from_name}'. Balance: ${from_balance:.2f}")
+    credit = credited_amount(to_type, amount, premium)
+
+    conn.executemany("UPDATE accounts SET balance = balance + ? WHERE username=? AND name=?",
+                     [(-debit, username, from_name), (credit, username, to_name)])
+
+    timestamp = datetime.datetime.now().isoformat()
+    rows = [
+        (username, f"Withdraw from {from_name}", amount, w_fee, timestamp),
+        (username, f"deposit to {to_name}", amount, 0.0, timestamp),
+        (username, f"Transfer to {to_name}", amount, t_fee, timestamp),
+    ]
+    if credit != amount:
+        # Deposit bonus of the receiving account type
+        rows.append((username, f"interest on {to_name}", credit - amount, 0.0, timestamp))
+    conn.executemany("""INSERT INTO transactions (username, type, amount, fee, timestamp)
+                        VALUES (?, ?, ?, ?, ?)""", rows)
+    return {from_name: from_balance - debit, to_name: to_balance + credit}
+
+
+@instrumentation.timed("db.transfer")
+def transfer(username, from_name, to_name, amount, premium=False):
+    """Move amount between two accounts; returns their new balances"""
+    if from_name == to_name:
+        raise TransferError("Cannot transfer to the same account")
+    if not (amount > 0 and math.isfinite(amount)):
+        raise TransferError("Transfer amount must be a positive number")
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            # A failed or rolled-back attempt hands its velocity slot back
+            with velocity.held(), db.transaction(immediate=True, username=username) as conn:
+                balances = _apply(conn, username, from_name, to_name, amount, premium)
+            return balances
+        except sqlite3.OperationalError as error:
+            if not _is_busy(error) or attempt == MAX_RETRIES:
+                raise
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random()))
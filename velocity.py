@@ -0,0 +1,343 @@
+"""Sliding-window velocity limits for withdrawals and transfers.
+
+    with velocity.held():                       # reservations undone if the block raises
+        velocity.reserve("alice", "checking", "BankAccount", 200)   # may raise VelocityError
+        ...                                     # the withdrawal itself
+    python velocity.py --user alice             # current window usage
+
+RULES limit how many withdrawals/transfers, and how much money, may
+leave a user (all accounts) or one account within a window. Rules are
+chosen by account type and premium tier: the "*" rules for the tier
+always apply and an account type's own rules add to them.
+
+Each (user or account, window length) keeps its recent operations in a
+ring buffer of timestamps and amounts, with a running total, so a
+decision drops the expired entries and compares two numbers instead of
+scanning the ledger. reserve() checks and counts the operation under one
+lock, so concurrent requests can't all pass before any of them counts;
+held() hands the slots back if the operation then fails or rolls back.
+rebuild() refills the rings from the ledger's withdraw rows inside the
+longest window, so a restart doesn't reset anyone's limits.
+
+State is per process: several app processes each enforce the limits on
+what they have seen since their own rebuild().
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import threading
+import time
+from array import array
+
+import db
+import instrumentation
+import schema
+
+ENABLED = os.environ.get("BANK_VELOCITY", "1") != "0"
+
+USER = "user"
+ACCOUNT = "account"
+BASIC = "basic"
+PREMIUM = "premium"
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# (account type or "*", tier) -> [(scope, window seconds, max operations, max amount or None)]
+RULES = {
+    ("*", BASIC): [(USER, MINUTE, 10, 5000.0), (USER, DAY, 100, 20000.0), (ACCOUNT, MINUTE, 5, None)],
+    ("*", PREMIUM): [(USER, MINUTE, 30, 25000.0), (USER, DAY, 300, 100000.0),
+                     (ACCOUNT, MINUTE, 15, None)],
+    ("SavingsAcct", BASIC): [(ACCOUNT, DAY, 6, None)],
+    ("SavingsAcct", PREMIUM): [(ACCOUNT, DAY, 12, None)],
+}
+
+PRUNE_EVERY = 10000  # records between sweeps for idle keys
+
+
+class Ring:
+    """Timestamps and amounts of the operations inside one window"""
+    __slots__ = ("window", "capacity", "times", "amounts", "head", "size", "total")
+
+    def __init__(self, window, capacity):
+        self.window = window
+        self.capacity = capacity
+        self.times = array("d")  # grows by doubling up to capacity
+        self.amounts = array("d")
+        self.head = 0
+        self.size = 0
+        self.total = 0.0
+
+    def expire(self, now):
+        cutoff = now - self.window
+        length = len(self.times)
+        while self.size and self.times[self.head] <= cutoff:
+            self.total -= self.amounts[self.head]
+            self.head = (self.head + 1) % length
+            self.size -= 1
+        if not self.size:
+            self.total = 0.0  # no float drift across bursts
+
+    def add(self, now, amount):
+        length = len(self.times)
+        if self.size == length:
+            if length < self.capacity:
+                # Unroll into order and grow
+                order = [(self.head + i) % length for i in range(self.size)] if length else []
+                grow = min(self.capacity, max(4, length * 2))
+                self.times = array("d", [self.times[i] for i in order] + [0.0] * (grow - length))
+                self.amounts = array("d", [self.amounts[i] for i in order] + [0.0] * (grow - length))
+                self.head, length = 0, grow
+            else:
+                # Full at capacity (only when rebuilding): drop the oldest
+                self.total -= self.amounts[self.head]
+                self.head = (self.head + 1) % length
+                self.size -= 1
+        tail = (self.head + self.size) % length
+        self.times[tail] = now
+        self.amounts[tail] = amount
+        self.size += 1
+        self.total += amount
+
+    def remove(self, when, amount):
+        """Take back one entry (a released reservation); newest first"""
+        length = len(self.times)
+        for back in range(self.size - 1, -1, -1):
+            i = (self.head + back) % length
+            if self.times[i] == when and self.amounts[i] == amount:
+                for step in range(back, self.size - 1):
+                    here = (self.head + step) % length
+                    following = (here + 1) % length
+                    self.times[here] = self.times[following]
+                    self.amounts[here] = self.amounts[following]
+                self.size -= 1
+                self.total = self.total - amount if self.size else 0.0
+                return True
+        return False  # already expired
+
+
+class VelocityLimiter:
+    def __init__(self, rules=None, enabled=ENABLED):
+        self.rules = rules or RULES
+        self.enabled = enabled
+        # scope -> {window: ring capacity}, the largest count any rule needs
+        self._windows = {USER: {}, ACCOUNT: {}}
+        for rules_list in self.rules.values():
+            for scope, window, count, _ in rules_list:
+                self._windows[scope][window] = max(self._windows[scope].get(window, 0), count)
+        self._rings = {}  # (username,) or (username, account) -> {window: Ring}
+        self._lock = threading.Lock()
+        self._since_prune = 0
+        self._stats = {"checks": 0, "rejected": 0, "recorded": 0, "released": 0}
+
+    def rules_for(self, account_type, premium):
+        tier = PREMIUM if premium else BASIC
+        return self.rules.get(("*", tier), []) + self.rules.get((account_type, tier), [])
+
+    def _rings_for(self, key, scope):
+        rings = self._rings.get(key)
+        if rings is None:
+            rings = self._rings[key] = {window: Ring(window, capacity)
+                                        for window, capacity in self._windows[scope].items()}
+        return rings
+
+    def reserve(self, username, account, account_type, amount, premium=False, now=None):
+        """Count one more operation of amount, or raise account_models.VelocityError
+
+        The check and the count happen under one lock, so a burst can't all
+        pass before any of it is counted. Returns the reservation for
+        release(), or None when limits are off.
+        """
+        if not self.enabled:
+            return None
+        now = time.time() if now is None else now
+        keys = {USER: (username,), ACCOUNT: (username, account)}
+        with self._lock:
+            self._stats["checks"] += 1
+            for scope, window, max_count, max_amount in self.rules_for(account_type, premium):
+                ring = self._rings.get(keys[scope], {}).get(window)
+                size, total = 0, 0.0
+                if ring is not None:
+                    ring.expire(now)
+                    size, total = ring.size, ring.total
+                if size >= max_count or (max_amount is not None and total + amount > max_amount):
+                    from account_models import VelocityError  # account_models imports us
+                    self._stats["rejected"] += 1
+                    what = "this account" if scope == ACCOUNT else "your accounts"
+                    limit = f"{max_count} withdrawals/transfers"
+                    if max_amount is not None:
+                        limit += f" or ${max_amount:,.2f}"
+                    raise VelocityError(f"Limit reached for {what}: {limit} per {_describe(window)}. "
+                                        f"Try again later.")
+            self._add(username, account, amount, now)
+        return (username, account, amount, now)
+
+    def release(self, reservation):
+        """Hand back a reservation whose operation failed or rolled back"""
+        username, account, amount, when = reservation
+        with self._lock:
+            for key in ((username,), (username, account)):
+                for ring in self._rings.get(key, {}).values():
+                    ring.remove(when, amount)
+            self._stats["released"] += 1
+
+    def record(self, username, account, amount, now=None):
+        """Count an operation without checking it (rebuild)"""
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._add(username, account, amount, now)
+
+    def _add(self, username, account, amount, now):
+        for key, scope in (((username,), USER), ((username, account), ACCOUNT)):
+            if account is None and scope == ACCOUNT:
+                continue
+            for ring in self._rings_for(key, scope).values():
+                ring.expire(now)
+                ring.add(now, amount)
+        self._stats["recorded"] += 1
+        self._since_prune += 1
+        if self._since_prune >= PRUNE_EVERY:
+            self._prune(now)
+
+    def _prune(self, now):
+        self._since_prune = 0
+        idle = []
+        for key, rings in self._rings.items():
+            for ring in rings.values():
+                ring.expire(now)
+            if not any(ring.size for ring in rings.values()):
+                idle.append(key)
+        for key in idle:
+            del self._rings[key]
+
+    def usage(self, username, account=None, now=None):
+        """{window: (operations, amount)} for a user, or one of their accounts"""
+        now = time.time() if now is None else now
+        key = (username,) if account is None else (username, account)
+        with self._lock:
+            rings = self._rings.get(key, {})
+            for ring in rings.values():
+                ring.expire(now)
+            return {window: (ring.size, ring.total) for window, ring in sorted(rings.items())}
+
+    def rebuild(self, now=None):
+        """Refill the rings from ledger withdraw rows in the longest window; returns rows read"""
+        now = time.time() if now is None else now
+        longest = max(w for windows in self._windows.values() for w in windows)
+        since = datetime.datetime.fromtimestamp(now - longest).isoformat()
+        with self._lock:
+            self._rings.clear()
+        loaded = 0
+        for pool in db.data_pools():
+            with pool.connection() as conn:
+                # "Withdraw from <account>" (withdrawals and transfer debits); bare
+                # "withdraw" rows, written by SavingsAcct before it named the
+                # account, only count toward the user's limits
+                rows = conn.execute("""SELECT username, type, amount, timestamp FROM transactions
+                                       WHERE timestamp >= ? AND lower(type) LIKE 'withdraw%'
+                                       ORDER BY timestamp, id""", (since,)).fetchall()
+            for username, trans_type, amount, timestamp in rows:
+                account = trans_type[len("withdraw from "):] if trans_type.lower().startswith(
+                    "withdraw from ") else None
+                self.record(username, account, amount or 0.0,
+                            datetime.datetime.fromisoformat(timestamp).timestamp())
+            loaded += len(rows)
+        return loaded
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._stats, keys=len(self._rings))
+
+
+def _describe(window):
+    for size, name in ((DAY, "day"), (HOUR, "hour"), (MINUTE, "minute")):
+        if window % size == 0:
+            count = window // size
+            return name if count == 1 else f"{count} {name}s"
+    return f"{window} seconds"
+
+
+_limiter = VelocityLimiter()
+_rebuilt = False
+_rebuild_lock = threading.Lock()
+_held = threading.local()  # .scopes: a stack of reservation lists, one per held() block
+
+
+def configure(rules=None, enabled=ENABLED):
+    """Replace the shared limiter (tests, benchmarks, custom rules)"""
+    global _limiter, _rebuilt
+    _limiter = VelocityLimiter(rules, enabled)
+    _rebuilt = False
+    return _limiter
+
+
+def reserve(username, account, account_type, amount, premium=False):
+    """Count an operation against the limits; inside held(), undone if the block raises"""
+    limiter = _limiter
+    reservation = limiter.reserve(username, account, account_type, amount, premium)
+    scopes = getattr(_held, "scopes", None)
+    if reservation is not None and scopes:
+        scopes[-1].append((limiter, reservation))
+    return reservation
+
+
+@contextlib.contextmanager
+def held():
+    """Release the reservations made in this block if it raises
+
+    Blocks nest: on success the reservations pass to the enclosing block,
+    so a transaction wrapped around a withdrawal can still undo them.
+    """
+    scopes = _held.__dict__.setdefault("scopes", [])
+    scopes.append([])
+    try:
+        yield
+    except BaseException:
+        for limiter, reservation in scopes.pop():
+            limiter.release(reservation)
+        raise
+    reservations = scopes.pop()
+    if scopes:
+        scopes[-1].extend(reservations)
+
+
+def usage(username, account=None):
+    return _limiter.usage(username, account)
+
+
+def ensure_rebuilt():
+    """Load recent ledger rows once per process (app startup)"""
+    global _rebuilt
+    if _rebuilt or not _limiter.enabled:
+        return
+    with _rebuild_lock:
+        if not _rebuilt:
+            _limiter.rebuild()
+            _rebuilt = True
+
+
+instrumentation.register_collector("velocity", lambda: _limiter.metrics())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Velocity limit usage")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: bank.db)")
+    parser.add_argument("--shards", type=int, default=db.SHARDS)
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--account")
+    args = parser.parse_args(argv)
+
+    db.configure(args.db, shards=args.shards)
+    schema.ensure()
+    started = time.perf_counter()
+    rows = _limiter.rebuild()
+    print(f"Rebuilt from {rows} ledger row(s) in {time.perf_counter() - started:.2f}s")
+    for window, (count, total) in usage(args.user, args.account).items():
+        print(f"  last {_describe(window):<10}{count:>5} operation(s)  ${total:,.2f}")
+
+
+if __name__ == "__main__":
+    main()